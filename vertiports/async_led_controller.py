@@ -0,0 +1,421 @@
+import asyncio
+import logging
+import time
+from led_controller import STMLedController
+from protocol import (WHO_I_AM_KEY, WHO_I_AM_REQUEST, Ack, CommandEncoder, DeltaFilter, Error, FrameDecoder,
+                      ResponseMatcher, commandKey, validateCommand, vertiportFrame)
+from rtt_estimator import RttEstimator
+from scheduler import Backoff
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class CommandSuperseded(Exception):
+    """Команда не подтверждена и не будет повторена: порту уже задано новое состояние."""
+
+
+class AsyncSTMLedController:
+    """Управление RGB лентами через TCP-контроллер на asyncio.
+
+    Повторяет интерфейс STMLedController (changeVertiport/whoIAm/disconnect),
+    но подключение, переподключение и чтение ответов выполняются сопрограммами
+    одного цикла событий - без потоков и threading.Timer. Один цикл может
+    обслуживать десятки контроллеров. Ответы читает отдельная задача и
+    передаёт их ожидающим запросам через ResponseMatcher.
+
+    Состояния соединения и переподключение с нарастающей задержкой (Backoff)
+    те же, что у STMLedController; каждый переход передаётся в onStateChanged.
+
+    send() держит в полёте до window команд: каждая получает future, который
+    разрешается подтверждением (Ack или Error), а при отсутствии ответа за
+    ackTimeout команда отправляется повторно до retries раз. Команда, которую
+    вытеснила более новая команда того же порта, не повторяется: её future
+    получает CommandSuperseded.
+
+    Команды, не меняющие подтверждённое состояние порта (с точностью до
+    minColorDelta), не отправляются: см. DeltaFilter.
+    """
+
+    DISCONNECTED = STMLedController.DISCONNECTED
+    CONNECTING = STMLedController.CONNECTING
+    HANDSHAKING = STMLedController.HANDSHAKING
+    CONNECTED = STMLedController.CONNECTED
+    BACKOFF = STMLedController.BACKOFF
+
+    VertiportCommand = STMLedController.VertiportCommand
+    MAX_UNACKED = STMLedController.MAX_UNACKED
+
+    class InFlight:
+        """Отправленная команда, ожидающая подтверждения."""
+        def __init__(self, frame, key, future):
+            self.frame = frame
+            self.key = key
+            self.future = future
+            self.attempts = 0
+            self.timer = None
+
+    def __init__(self, ip=None, port=None, rttEstimator=None, backoff=None, onStateChanged=None,
+                 window=32, ackTimeout=None, retries=3, minColorDelta=1):
+        self.ip = ip
+        self.port = port
+        self.connectTimeout = 2  # Верхняя граница таймаутов, пока RTT не измерен
+        self.rttEstimator = rttEstimator or RttEstimator(floor=0.2, ceiling=self.connectTimeout)
+        self.backoff = backoff or Backoff()
+        self.onStateChanged = onStateChanged
+        self.state = self.DISCONNECTED
+        self.retryIn = None  # Задержка до следующей попытки в состоянии backoff
+        self.connectLock = asyncio.Lock()  # Одно подключение за раз: connect() и переподключение
+        self.windowSlots = asyncio.Semaphore(window)  # Сколько команд send() может быть в полёте
+        self.ackTimeout = ackTimeout  # None - по измеренному RTT
+        self.retries = retries
+        self.reader = None
+        self.writer = None
+        self.deviceId = -1
+        self.closed = False
+        self.decoder = FrameDecoder()
+        self.matcher = ResponseMatcher(limit=self.MAX_UNACKED)
+        self.rejectedCommands = 0
+        self.acksSeen = False  # Устройство хоть раз подтвердило команду: прошивка с Ack
+        self.delta = DeltaFilter(minColorDelta)
+        self.encoder = CommandEncoder()
+        self.readTask = None
+        self.reconnectTask = None
+
+        # Инициализация команд для каждого порта
+        self.vertiportsCommand = [self.VertiportCommand() for _ in range(6)]
+        self.dirtyPorts = set()  # Порты, изменённые после последнего commit()
+        self.configuredPorts = set()  # Порты, для которых задано желаемое состояние
+        self.lastCommand = None
+        self.lastVertiportId = None
+
+    @property
+    def connected(self):
+        return self.state == self.CONNECTED
+
+    def _setState(self, state, retryIn=None):
+        """Переводит соединение в новое состояние и сообщает об этом."""
+        self.retryIn = retryIn
+        if state == self.state:
+            return
+        logging.info(f"Controller {self.ip}:{self.port}: {self.state} -> {state}")
+        self.state = state
+        if self.onStateChanged:
+            self.onStateChanged(self)
+
+    def _timeout(self):
+        """Таймаут операций по измеренному RTT."""
+        return self.rttEstimator.timeout(self.connectTimeout)
+
+    async def connect(self):
+        """Подключается к контроллеру, сверяет ID и восстанавливает порты; True при успехе.
+
+        Ожидающее переподключение отменяется; при неудаче запускается новое.
+        """
+        self.closed = False
+        if self.reconnectTask and self.reconnectTask is not asyncio.current_task():
+            self.reconnectTask.cancel()
+            self.reconnectTask = None
+        if await self._establish():
+            logging.info("Connected to device: %s", hex(self.deviceId))
+            return True
+        self._scheduleReconnect()
+        return False
+
+    async def _establish(self):
+        """Подключение и рукопожатие, если соединения ещё нет; при неудаче соединение закрывается."""
+        async with self.connectLock:
+            if self.connected:
+                return True
+            self._closeStreams()  # Полуоткрытое соединение прошлой попытки не оставляем
+            self._setState(self.CONNECTING)
+            if await self._open():
+                self._setState(self.HANDSHAKING)
+                if await self.restoreState():
+                    self.backoff.reset()
+                    self._setState(self.CONNECTED)
+                    return True
+            self._closeStreams()
+            return False
+
+    async def _open(self):
+        """Открывает TCP-соединение."""
+        logging.info(f"Creating connection to {self.ip}:{self.port}")
+        start = time.monotonic()
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self._timeout())
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.error(f"Failed to connect to {self.ip}:{self.port}: {e}")
+            return False
+        self.rttEstimator.addSample(time.monotonic() - start)
+        self.readTask = asyncio.get_running_loop().create_task(self._readLoop(self.reader))
+        return True
+
+    def _closeStreams(self):
+        """Закрывает соединение и снимает все ожидания ответов."""
+        if self.readTask and self.readTask is not asyncio.current_task():
+            self.readTask.cancel()
+        self.readTask = None
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+        self.decoder.reset()
+        self.delta.reset()
+        for waiter in self.matcher.clear():
+            if isinstance(waiter, self.InFlight):
+                waiter.timer.cancel()
+                waiter = waiter.future
+            if isinstance(waiter, asyncio.Future) and not waiter.done():
+                waiter.set_exception(ConnectionError("Connection lost before reply"))
+
+    def _dropConnection(self):
+        """Закрывает сокет после ошибки и запускает переподключение."""
+        self._closeStreams()
+        if self.state != self.CONNECTED:
+            return  # Подключение ещё идёт: неудачу обработает _establish()
+        self._setState(self.DISCONNECTED)
+        self._scheduleReconnect()
+
+    async def _write(self, msg):
+        """Отправка сообщения на контроллер."""
+        if not self.writer:
+            logging.warning("Connection lost, initiating reconnect...")
+            self._scheduleReconnect()
+            return False
+        try:
+            self.writer.write(msg)
+            await self.writer.drain()
+            return True
+        except OSError as e:
+            logging.error(f"Error sending data: {e}")
+            self._dropConnection()
+            return False
+
+    async def _readLoop(self, reader):
+        """Читает поток ответов и передаёт их ожидающим запросам."""
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                self.decoder.feed(data)
+                for response in self.decoder.frames(self.matcher.expectations):
+                    self._dispatch(response)
+        except OSError as e:
+            logging.error(f"Error receiving data: {e}")
+        if reader is self.reader:
+            logging.warning("Connection closed by controller.")
+            self._dropConnection()
+
+    def _dispatch(self, response):
+        """Передаёт ответ ожидающему его запросу."""
+        if isinstance(response, Ack):
+            self.acksSeen = True
+        waiter = self.matcher.match(response)
+        if waiter is None:
+            return
+        if isinstance(response, Error):
+            self.rejectedCommands += 1
+            logging.warning(f"Controller rejected vertiport {response.port} command, code {response.code}")
+        elif isinstance(response, Ack) and not self.matcher.expecting(response.key):
+            self.delta.markAcked(response)
+        if isinstance(waiter, self.InFlight):
+            waiter.timer.cancel()
+            waiter = waiter.future
+        if isinstance(waiter, asyncio.Future) and not waiter.done():
+            waiter.set_result(response)
+
+    async def whoIAm(self):
+        """Определение устройства по уникальному идентификатору."""
+        if not self.writer:
+            return -1
+        start = time.monotonic()
+        waiter = self.matcher.expect(WHO_I_AM_KEY, asyncio.get_running_loop().create_future())
+        if not await self._write(WHO_I_AM_REQUEST):
+            return -1
+        try:
+            response = await asyncio.wait_for(waiter, self._timeout())
+        except asyncio.TimeoutError:
+            self.matcher.discard(WHO_I_AM_KEY, waiter)
+            return -1
+        except ConnectionError:
+            return -1  # Соединение разорвано, ожидание снято в _closeStreams
+        self.rttEstimator.addSample(time.monotonic() - start)
+        return response.deviceId
+
+    def stageVertiport(self, id, status, r, g, b):
+        """Запоминает новое состояние порта в vertiportsCommand без отправки."""
+        validateCommand(id, status, r, g, b)
+        command = self.vertiportsCommand[id]
+        command.status, command.r, command.g, command.b = status, r, g, b
+        self.dirtyPorts.add(id)
+        self.configuredPorts.add(id)
+        self.lastCommand = (id, status, r, g, b)
+        self.lastVertiportId = id
+
+    async def commit(self):
+        """Отправляет все подготовленные изменения портов одним буфером."""
+        if not self.dirtyPorts:
+            return True
+        self._encodePorts(self.dirtyPorts)
+        self.dirtyPorts.clear()
+        # Транспорт asyncio может держать ссылку на данные до отправки, поэтому буфер копируется
+        return await self._write(bytes(self.encoder.view())) if len(self.encoder) else True
+
+    def _encodePorts(self, ports, futures=False):
+        """Кодирует изменившиеся порты в encoder; с futures=True возвращает future подтверждения каждого."""
+        waiters = []
+        self.encoder.clear()
+        for id in sorted(ports):
+            command = self.vertiportsCommand[id]
+            if self.delta.unchanged(id, command.status, command.r, command.g, command.b):
+                continue
+            self.encoder.pack(id, command.status, command.r, command.g, command.b)
+            self.delta.markSent(id, command.status, command.r, command.g, command.b)
+            waiter = asyncio.get_running_loop().create_future() if futures else None
+            waiters.append(self.matcher.expect(commandKey(id, command.status, command.r, command.g, command.b),
+                                               waiter))
+        return waiters
+
+    async def applyAll(self, commands):
+        """Применяет набор команд (id, status, r, g, b) одной записью в сокет."""
+        for command in commands:
+            self.stageVertiport(*command)
+        return await self.commit()
+
+    async def changeVertiport(self, id, status, r, g, b):
+        """Изменение состояния и цвета для указанного порта."""
+        self.stageVertiport(id, status, r, g, b)
+        await self.commit()
+        logging.info(f"Changed vertiport {id} to status={status}, color=({r}, {g}, {b})")
+
+    async def send(self, id, status, r, g, b):
+        """Отправляет команду порта без ожидания ответа; возвращает future подтверждения.
+
+        Ждёт только тогда, когда в полёте уже window команд. Если порт уже в
+        нужном состоянии, команда не отправляется, а future сразу содержит Ack.
+        """
+        validateCommand(id, status, r, g, b)
+        if self.delta.unchanged(id, status, r, g, b):
+            self.stageVertiport(id, status, r, g, b)
+            self.dirtyPorts.discard(id)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(Ack(id, *self.delta.sent[id]))
+            return future
+        await self.windowSlots.acquire()
+        self.stageVertiport(id, status, r, g, b)
+        self.dirtyPorts.discard(id)  # Команда уходит сразу, commit() её не повторяет
+        command = self.InFlight(vertiportFrame(id, status, r, g, b), commandKey(id, status, r, g, b),
+                                asyncio.get_running_loop().create_future())
+        command.future.add_done_callback(lambda _: self.windowSlots.release())
+        self._transmit(command)
+        if self.writer:
+            try:
+                await self.writer.drain()  # Ждёт, только если переполнен буфер отправки
+            except OSError:
+                pass  # Разрыв обнаружит задача чтения
+        return command.future
+
+    async def sendAll(self, commands):
+        """Отправляет команды конвейером и ждёт подтверждения всех; возвращает список ответов."""
+        futures = [await self.send(*command) for command in commands]
+        return await asyncio.gather(*futures)
+
+    def _transmit(self, command):
+        """Записывает кадр команды и запускает таймер повторной отправки."""
+        if not self.writer:
+            command.future.set_exception(ConnectionError(f"Not connected to {self.ip}:{self.port}"))
+            self._scheduleReconnect()
+            return
+        command.attempts += 1
+        self.delta.markSent(*command.key[1:])
+        self.matcher.expect(command.key, command)
+        command.timer = asyncio.get_running_loop().call_later(
+            self.ackTimeout or self._timeout(), self._onAckTimeout, command)
+        self.writer.write(command.frame)
+
+    def _onAckTimeout(self, command):
+        self.matcher.discard(command.key, command)
+        if command.future.done():
+            return
+        id = command.frame[1]
+        desired = self.vertiportsCommand[id]
+        if command.key != commandKey(id, desired.status, desired.r, desired.g, desired.b):
+            command.future.set_exception(CommandSuperseded(f"Vertiport {id} command superseded before ack"))
+            return
+        if command.attempts > self.retries:
+            command.future.set_exception(asyncio.TimeoutError(
+                f"No acknowledgement for vertiport {command.frame[1]} after {command.attempts} attempts"))
+            return
+        logging.warning(f"Retransmitting vertiport {command.frame[1]} command (attempt {command.attempts + 1})")
+        self._transmit(command)
+
+    async def restoreState(self):
+        """Сверяет ID устройства и восстанавливает на нём все заданные порты одной записью.
+
+        Таблица портов отправляется только тому же устройству, что и раньше, и
+        считается восстановленной после подтверждения каждой команды. Если
+        устройство ещё ни разу не подтверждало команды (старая прошивка без Ack),
+        проверкой служит совпавший WhoIAm, а отсутствие подтверждений - только
+        предупреждение.
+        """
+        deviceId = await self.whoIAm()
+        if deviceId == -1:
+            logging.warning("Device did not answer WhoIAm.")
+            return False
+        if self.deviceId not in (-1, deviceId):
+            logging.error(f"Device ID changed after reconnect: {hex(self.deviceId)} -> {hex(deviceId)}; "
+                          f"state is not restored")
+            return False
+        self.deviceId = deviceId
+        waiters = self._encodePorts(self.configuredPorts, futures=True)
+        self.dirtyPorts -= self.configuredPorts
+        if waiters:
+            if not await self._write(bytes(self.encoder.view())):
+                return False
+            try:
+                await asyncio.wait_for(asyncio.gather(*waiters), self._timeout())
+            except ConnectionError:
+                return False
+            except asyncio.TimeoutError:
+                if self.acksSeen:
+                    logging.warning("Device did not confirm restored vertiports.")
+                    return False
+                logging.warning("Device does not acknowledge commands; restored vertiports are unconfirmed")
+        logging.info(f"Restored {len(self.configuredPorts)} vertiports on device {hex(deviceId)}")
+        return True
+
+    def _scheduleReconnect(self):
+        """Запускает сопрограмму переподключения, если она ещё не работает."""
+        if self.closed or self.connected or (self.reconnectTask and not self.reconnectTask.done()):
+            return
+        self.reconnectTask = asyncio.get_running_loop().create_task(self._reconnectLoop())
+
+    async def _reconnectLoop(self):
+        """Попытки восстановления подключения с нарастающей задержкой до успеха или disconnect()."""
+        while not self.closed and not self.connected:
+            delay = self.backoff.next()
+            self._setState(self.BACKOFF, delay)
+            await asyncio.sleep(delay)
+            if self.closed or self.connected:
+                return  # За время ожидания подключился connect() или вызван disconnect()
+            logging.info(f"Attempting to reconnect to {self.ip}:{self.port}")
+            if await self._establish():
+                logging.info("Reconnected successfully.")
+            else:
+                logging.warning("Reconnect failed. Retrying...")
+
+    async def disconnect(self):
+        """Отключение от контроллера."""
+        self.closed = True
+        if self.reconnectTask and self.reconnectTask is not asyncio.current_task():
+            self.reconnectTask.cancel()
+        writer = self.writer
+        self._closeStreams()
+        self._setState(self.DISCONNECTED)
+        if writer:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
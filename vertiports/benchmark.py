@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from async_led_controller import AsyncSTMLedController
+from controller_emulator import EmulatorFleet
+from controller_fleet import ControllerFleet
+from device_cache import DeviceCache
+from device_scanner import DeviceScanner
+from led_controller import STMLedController
+from protocol import Ack, commandKey
+from scheduler import Scheduler
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCAN_PREFIXES = (26, 24, 22)
+SCAN_DEVICES = 4  # Эмуляторы ставятся в середину подсети: первое устройство находится до конца обхода
+SCAN_NETWORK_BASE = ipaddress.IPv4Address('127.1.0.0')
+FLEET_FIRST_ALIAS = '127.2.0.1'
+
+
+class LoopbackScanner(DeviceScanner):
+    """DeviceScanner, обходящий заданную loopback-подсеть вместо сетей машины."""
+
+    def __init__(self, network, **kwargs):
+        super().__init__(**kwargs)
+        self.network = ipaddress.IPv4Interface(network)
+        self.rttEstimator.addSample(0.001)  # RTT loopback: без замера шлюза, результат не зависит от сети машины
+
+    def _getLocalNetworks(self):
+        return [("lo", self.network)]
+
+    def _getNeighbors(self):
+        return {}
+
+
+class TimedController(STMLedController):
+    """STMLedController, замеряющий задержку каждой команды от записи до разбора её Ack в pollResponses()."""
+
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        self.sentAt = defaultdict(deque)  # Ключ команды -> времена отправки ещё не подтверждённых
+        super().__init__(*args, **kwargs)
+
+    def _encode(self, id, status, r, g, b):
+        encoded = super()._encode(id, status, r, g, b)
+        if encoded:
+            self.sentAt[commandKey(id, status, r, g, b)].append(time.monotonic())
+        return encoded
+
+    def _dispatch(self, response):
+        if isinstance(response, Ack) and self.sentAt.get(response.key):
+            self.latencies.append(time.monotonic() - self.sentAt[response.key].popleft())
+        super()._dispatch(response)
+
+
+class TimedAsyncController(AsyncSTMLedController):
+    """AsyncSTMLedController, замеряющий задержку каждой команды от первой записи до её подтверждения."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def _transmit(self, command):
+        if command.attempts == 0:  # Повторы не сбрасывают отметку: задержка включает потери
+            sentAt = time.monotonic()
+
+            def onDone(future):
+                if not future.cancelled() and isinstance(future.exception() or future.result(), Ack):
+                    self.latencies.append(time.monotonic() - sentAt)
+
+            command.future.add_done_callback(onDone)
+        super()._transmit(command)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _metric(value, unit, better):
+    return {"value": round(value, 6), "unit": unit, "better": better}
+
+
+def benchmarkScan(prefix, cacheDir):
+    """Время до первого устройства и до конца полного обхода подсети /prefix."""
+    network = ipaddress.IPv4Network(f"{SCAN_NETWORK_BASE}/{prefix}")
+    fleet = EmulatorFleet(SCAN_DEVICES, aliases=True, udp=False,
+                          firstAlias=str(network[network.num_addresses // 2]))
+    fleet.startInThread()
+    try:
+        cache = DeviceCache(os.path.join(cacheDir, f"scan{prefix}.json"))
+        scanner = LoopbackScanner(network, port=fleet.emulators[0].port, cache=cache,
+                                  udpDiscovery=False, maxPrefix=min(prefix, 20))
+        found = []
+        start = time.monotonic()
+        scanner.deviceFound.connect(lambda ip: found.append(time.monotonic() - start))
+        scanner.scanNetwork()
+        total = time.monotonic() - start
+    finally:
+        fleet.stopThread()
+    if len(found) != SCAN_DEVICES:
+        raise RuntimeError(f"/{prefix}: found {len(found)} of {SCAN_DEVICES} emulators")
+    return {
+        f"scan/{prefix}/first_device": _metric(min(found), "s", "lower"),
+        f"scan/{prefix}/complete": _metric(total, "s", "lower"),
+    }
+
+
+def _commandColor(i):
+    """Цвет i-й команды не повторяется (до 65536 команд), поэтому фильтр повторов ничего не отсеивает."""
+    return i & 0xff, (i >> 8) & 0xff, 0
+
+
+def _changeCommands(host, port, count):
+    """Отправляет count команд через changeVertiport, как GUI; возвращает (задержки подтверждений, общее время)."""
+    controller = TimedController(host, port, autoReconnect=False)
+    if not controller.connected:
+        raise RuntimeError(f"Could not connect to {host}:{port}")
+    try:
+        start = time.monotonic()
+        for i in range(count):
+            controller.changeVertiport(i % 6, 1, *_commandColor(i))
+        while controller.pollResponses():
+            if time.monotonic() - start > 30:
+                raise RuntimeError(f"{controller.matcher.outstanding()} commands were never acknowledged")
+            time.sleep(0.001)
+        elapsed = time.monotonic() - start
+    finally:
+        controller.disconnect()
+    return controller.latencies, elapsed
+
+
+async def _sendCommands(host, port, count):
+    """Отправляет count команд конвейером send(); возвращает (задержки подтверждений, общее время)."""
+    controller = TimedAsyncController(host, port)
+    if not await controller.connect():
+        raise RuntimeError(f"Could not connect to {host}:{port}")
+    try:
+        start = time.monotonic()
+        futures = []
+        for i in range(count):
+            futures.append(await controller.send(i % 6, 1, *_commandColor(i)))
+        responses = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 30)
+        elapsed = time.monotonic() - start
+    finally:
+        await controller.disconnect()
+    acknowledged = sum(isinstance(response, Ack) for response in responses)
+    if acknowledged != count:
+        raise RuntimeError(f"{count - acknowledged} commands were never acknowledged")
+    return controller.latencies, elapsed
+
+
+def benchmarkCommands(count):
+    """Пропускная способность и задержка каждой команды от записи в сокет до разбора её Ack.
+
+    Метрики названы по контроллеру: STMLedController.changeVertiport - путь GUI
+    через ControllerWorker, AsyncSTMLedController - конвейер send().
+    """
+    fleet = EmulatorFleet(1)
+    fleet.startInThread()
+    try:
+        host, port = fleet.addresses[0]
+        runs = {"STMLedController": _changeCommands(host, port, count),
+                "AsyncSTMLedController": asyncio.run(_sendCommands(host, port, count))}
+    finally:
+        fleet.stopThread()
+    metrics = {}
+    for name, (latencies, elapsed) in runs.items():
+        if len(latencies) != count:
+            raise RuntimeError(f"{name}: {count - len(latencies)} commands have no measured acknowledgement")
+        metrics[f"commands/{name}/throughput"] = _metric(count / elapsed, "cmd/s", "higher")
+        metrics[f"commands/{name}/p50"] = _metric(_percentile(latencies, 0.5), "s", "lower")
+        metrics[f"commands/{name}/p99"] = _metric(_percentile(latencies, 0.99), "s", "lower")
+    return metrics
+
+
+def benchmarkReconnect(rounds):
+    """Время от обрыва соединения платой до повторного подключения (с настройками backoff по умолчанию)."""
+    fleet = EmulatorFleet(1)
+    fleet.startInThread()
+    scheduler = Scheduler()
+    scheduler.start()
+    connected = threading.Event()
+
+    def onStateChanged(controller):
+        if controller.state == controller.CONNECTED:
+            connected.set()
+
+    try:
+        host, port = fleet.addresses[0]
+        controller = STMLedController(host, port, scheduler=scheduler, onStateChanged=onStateChanged)
+        recoveries = []
+        for i in range(rounds):
+            connected.clear()
+            start = time.monotonic()
+            fleet.loop.call_soon_threadsafe(fleet.emulators[0].dropClients)
+            while not connected.is_set():
+                controller.changeVertiport(i % 6, 1, 0, 0, 0)  # Обрыв обнаруживается на записи
+                if time.monotonic() - start > 30:
+                    raise RuntimeError("Controller did not reconnect")
+                connected.wait(0.005)
+            recoveries.append(time.monotonic() - start)
+        controller.disconnect()
+    finally:
+        scheduler.stop()
+        fleet.stopThread()
+    return {"reconnect/recovery": _metric(statistics.median(recoveries), "s", "lower")}
+
+
+def benchmarkFleet(count, rounds=5):
+    """Время подключения к count контроллерам и применения сцены ко всем с подтверждением."""
+    emulators = EmulatorFleet(count, aliases=True, udp=False, firstAlias=FLEET_FIRST_ALIAS)
+    emulators.startInThread()
+    fleet = ControllerFleet(port=emulators.emulators[0].port)
+    fleet.start()
+    try:
+        start = time.monotonic()
+        connected = fleet.addAll([host for host, _ in emulators.addresses]).result(30)
+        connectTime = time.monotonic() - start
+        if not all(connected.values()):
+            raise RuntimeError(f"Connected to {sum(connected.values())} of {count} emulators")
+        scenes = []
+        for i in range(rounds):
+            start = time.monotonic()
+            applied = fleet.broadcast(1, i * 40, 255, 255, confirm=True).result(30)  # Новый цвет: не отсеивается
+            scenes.append(time.monotonic() - start)
+            if not all(applied.values()):
+                raise RuntimeError(f"Scene applied on {sum(applied.values())} of {count} controllers")
+    finally:
+        fleet.stop()
+        emulators.stopThread()
+    return {
+        f"fleet/{count}/connect": _metric(connectTime, "s", "lower"),
+        f"fleet/{count}/scene": _metric(statistics.median(scenes), "s", "lower"),
+    }
+
+
+def runBenchmarks(prefixes=SCAN_PREFIXES, commands=5000, reconnects=5, fleet=50):
+    """Выполняет все замеры и возвращает результаты в формате JSON-отчёта."""
+    metrics = {}
+    with tempfile.TemporaryDirectory() as cacheDir:
+        for prefix in prefixes:
+            metrics.update(benchmarkScan(prefix, cacheDir))
+    metrics.update(benchmarkCommands(commands))
+    metrics.update(benchmarkReconnect(reconnects))
+    metrics.update(benchmarkFleet(fleet))
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "metrics": metrics,
+    }
+
+
+def compareResults(results, baseline, tolerance=0.2):
+    """Сравнивает с эталоном; возвращает список регрессий (имя, эталон, текущее значение)."""
+    regressions = []
+    for name, metric in results["metrics"].items():
+        reference = baseline.get("metrics", {}).get(name)
+        if not reference or not reference["value"]:
+            continue
+        change = (metric["value"] - reference["value"]) / reference["value"]
+        if metric["better"] == "higher":
+            change = -change
+        if change > tolerance:
+            regressions.append((name, reference["value"], metric["value"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры поиска контроллеров и пропускной способности команд")
+    parser.add_argument("--output", default="benchmark.json", help="куда сохранить результаты")
+    parser.add_argument("--baseline", help="эталонные результаты для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    parser.add_argument("--prefixes", type=int, nargs="+", default=list(SCAN_PREFIXES))
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--reconnects", type=int, default=5)
+    parser.add_argument("--fleet", type=int, default=50, help="число контроллеров для замера сцены")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)  # Журнал каждой команды искажает замеры
+    results = runBenchmarks(args.prefixes, args.commands, args.reconnects, args.fleet)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    for name, metric in results["metrics"].items():
+        print(f"{name:40} {metric['value']:>12.6f} {metric['unit']}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        regressions = compareResults(results, json.load(f), args.tolerance)
+    for name, reference, value in regressions:
+        print(f"REGRESSION {name}: {reference} -> {value}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
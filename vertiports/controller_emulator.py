@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import ipaddress
+import logging
+import random
+import socket
+import threading
+from protocol import (ACK, ERROR, ERROR_BAD_PORT, VERTIPORT_COMMAND, VERTIPORT_FRAME_SIZE, VERTIPORTS_COUNT,
+                      WHO_I_AM_REPLY, WHO_I_AM_REQUEST)
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class ControllerEmulator:
+    """Эмулятор TCP-контроллера вертипортов для проверок без оборудования.
+
+    Отвечает на WhoIAm кадром 0x42 id (по TCP и UDP, в том числе на широковещательный
+    запрос в подсеть адреса эмулятора), принимает команды 0x7e,
+    запоминает состояние каждого порта и подтверждает команды (ACK/ERROR).
+    acks=False и framedWhoIAm=False имитируют старую прошивку: команды без
+    подтверждений, ответ на WhoIAm одним байтом ID.
+
+    Плохую сеть и медленную прошивку имитируют параметры: latency - задержка
+    ответов, loss - доля теряемых кадров, disconnectRate - вероятность обрыва
+    соединения после кадра, readSize/readDelay - медленное чтение из сокета.
+    """
+
+    class UdpResponder(asyncio.DatagramProtocol):
+        """Отвечает на WhoIAm по UDP с адреса эмулятора (и на запросы, пришедшие на широковещательный сокет)."""
+        def __init__(self, emulator):
+            self.emulator = emulator
+            self.transport = None
+
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, addr):
+            if data == WHO_I_AM_REQUEST and not self.emulator._lost():
+                self.emulator.udpTransport.sendto(self.emulator._whoIAmReply(), addr)
+
+    class Client:
+        """Подключение к эмулятору; задержанные ответы отправляются по порядку отдельной задачей."""
+        def __init__(self, emulator, writer):
+            self.emulator = emulator
+            self.writer = writer
+            self.replies = asyncio.Queue()
+            self.sender = None
+            self.dropped = False
+
+        def reply(self, data):
+            if not self.emulator.latency:
+                self.writer.write(data)
+                return
+            loop = asyncio.get_running_loop()
+            self.replies.put_nowait((loop.time() + self.emulator.latency, data))
+            if self.sender is None:
+                self.sender = loop.create_task(self._send())
+
+        async def _send(self):
+            loop = asyncio.get_running_loop()
+            while True:
+                due, data = await self.replies.get()
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                self.writer.write(data)
+
+        def close(self):
+            if self.sender:
+                self.sender.cancel()
+            self.writer.close()
+
+    def __init__(self, host='127.0.0.1', port=502, deviceId=0x01, udp=True, acks=True, framedWhoIAm=True,
+                 latency=0.0, loss=0.0, disconnectRate=0.0, readSize=1024, readDelay=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.deviceId = deviceId
+        self.udp = udp
+        self.acks = acks  # False - старая прошивка без подтверждений команд
+        self.framedWhoIAm = framedWhoIAm  # False - старая прошивка отвечает на WhoIAm одним байтом ID
+        self.latency = latency
+        self.loss = loss
+        self.disconnectRate = disconnectRate
+        self.readSize = readSize
+        self.readDelay = readDelay
+        self.random = random.Random(seed)
+        self.ports = [(0, 0, 0, 0) for _ in range(VERTIPORTS_COUNT)]  # (status, r, g, b) каждого порта
+        self.commandsReceived = 0
+        self.framesLost = 0
+        self.disconnects = 0
+        self.clients = set()
+        self.server = None
+        self.udpTransport = None
+        self.broadcastTransport = None
+
+    async def start(self):
+        """Запускает TCP-сервер и UDP-ответчик; port=0 выбирает свободный порт."""
+        self.server = await asyncio.start_server(self._handleClient, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.udp:
+            loop = asyncio.get_running_loop()
+            self.udpTransport, _ = await loop.create_datagram_endpoint(
+                lambda: self.UdpResponder(self), sock=self._udpSocket(self.host))
+            if self.host not in ('', '0.0.0.0'):
+                try:
+                    self.broadcastTransport, _ = await loop.create_datagram_endpoint(
+                        lambda: self.UdpResponder(self), sock=self._udpSocket(''))
+                except OSError as e:
+                    logging.warning(f"Emulator {hex(self.deviceId)} does not receive UDP broadcasts: {e}")
+        logging.info(f"Emulator {hex(self.deviceId)} listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Останавливает эмулятор и разрывает открытые соединения."""
+        if self.broadcastTransport:
+            self.broadcastTransport.close()
+        if self.udpTransport:
+            self.udpTransport.close()
+        if self.server:
+            self.server.close()
+            self.dropClients()
+            await self.server.wait_closed()
+
+    def dropClients(self):
+        """Разрывает все открытые соединения, как при перезагрузке платы."""
+        for client in list(self.clients):
+            client.close()
+
+    def _udpSocket(self, host):
+        """UDP-сокет порта эмулятора; SO_REUSEADDR: широковещательный сокет ('') делит порт с адресными."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _whoIAmReply(self):
+        if self.framedWhoIAm:
+            return bytes([WHO_I_AM_REPLY, self.deviceId])
+        return bytes([self.deviceId])
+
+    def _lost(self):
+        if self.loss and self.random.random() < self.loss:
+            self.framesLost += 1
+            return True
+        return False
+
+    def _handleFrame(self, frame, client):
+        """Выполняет один принятый кадр."""
+        if self._lost():
+            return
+        if frame[0] == VERTIPORT_COMMAND:
+            _, id, status, r, g, b = frame
+            if id < VERTIPORTS_COUNT:
+                self.ports[id] = (status, r, g, b)
+                self.commandsReceived += 1
+                if self.acks:
+                    client.reply(bytes([ACK, id, status, r, g, b]))
+            elif self.acks:
+                client.reply(bytes([ERROR, id, status, r, g, b, ERROR_BAD_PORT]))
+        else:
+            client.reply(self._whoIAmReply())
+        if self.disconnectRate and self.random.random() < self.disconnectRate:
+            client.dropped = True
+
+    def _handleFrames(self, buffer, client):
+        """Разбирает накопленные байты; возвращает число обработанных."""
+        offset = 0
+        while offset < len(buffer) and not client.dropped:
+            if buffer[offset] == VERTIPORT_COMMAND:
+                if len(buffer) - offset < VERTIPORT_FRAME_SIZE:
+                    break
+                self._handleFrame(buffer[offset:offset + VERTIPORT_FRAME_SIZE], client)
+                offset += VERTIPORT_FRAME_SIZE
+            elif buffer[offset] == WHO_I_AM_REQUEST[0]:
+                if len(buffer) - offset < len(WHO_I_AM_REQUEST):
+                    break
+                if buffer[offset:offset + len(WHO_I_AM_REQUEST)] == WHO_I_AM_REQUEST:
+                    self._handleFrame(WHO_I_AM_REQUEST, client)
+                    offset += len(WHO_I_AM_REQUEST)
+                else:
+                    offset += 1
+            else:
+                offset += 1  # Неизвестный байт - пропускаем для ресинхронизации
+        return offset
+
+    async def _handleClient(self, reader, writer):
+        client = self.Client(self, writer)
+        self.clients.add(client)
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(self.readSize)
+                if not data:
+                    break
+                buffer += data
+                del buffer[:self._handleFrames(buffer, client)]
+                if client.dropped:
+                    self.disconnects += 1
+                    writer.transport.abort()
+                    break
+                await writer.drain()
+                if self.readDelay:
+                    await asyncio.sleep(self.readDelay)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            client.close()
+
+
+class EmulatorFleet:
+    """Набор эмуляторов для нагрузочных проверок сканера и контроллеров.
+
+    Эмуляторы запускаются либо на соседних портах одного адреса, либо (aliases=True)
+    на одном порту loopback-адресов подряд начиная с firstAlias - как контроллеры в подсети.
+    Остальные параметры передаются каждому ControllerEmulator.
+    """
+
+    def __init__(self, count, host='127.0.0.1', port=0, aliases=False, firstId=0x01, firstAlias='127.0.1.1',
+                 **options):
+        self.aliases = aliases
+        self.emulators = []
+        for i in range(count):
+            if aliases:
+                address = (str(ipaddress.IPv4Address(firstAlias) + i), port)
+            else:
+                address = (host, port + i if port else 0)
+            self.emulators.append(ControllerEmulator(*address, deviceId=(firstId + i) & 0xff, **options))
+        self.loop = None
+        self.thread = None
+
+    @property
+    def addresses(self):
+        """Адреса (host, port) эмуляторов."""
+        return [(emulator.host, emulator.port) for emulator in self.emulators]
+
+    async def start(self):
+        """Запускает все эмуляторы; при aliases и port=0 все получают порт первого."""
+        if not self.emulators:
+            return
+        first, rest = self.emulators[0], self.emulators[1:]
+        await first.start()
+        if self.aliases:
+            for emulator in rest:
+                emulator.port = first.port
+        await asyncio.gather(*(emulator.start() for emulator in rest))
+
+    async def stop(self):
+        """Останавливает все эмуляторы."""
+        await asyncio.gather(*(emulator.stop() for emulator in self.emulators))
+
+    def startInThread(self):
+        """Запускает эмуляторы в собственном цикле событий в фоновом потоке."""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.run(self.start())
+
+    def stopThread(self):
+        """Останавливает эмуляторы и фоновый поток."""
+        if not self.thread:
+            return
+        self.run(self.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
+
+    def run(self, coroutine):
+        """Выполняет сопрограмму в цикле эмуляторов и возвращает результат (из другого потока)."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+async def _serve(args):
+    fleet = EmulatorFleet(args.count, args.host, args.port, aliases=args.aliases, firstId=args.id,
+                          latency=args.latency, loss=args.loss, disconnectRate=args.disconnect_rate,
+                          readDelay=args.read_delay, seed=args.seed)
+    await fleet.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Эмулятор контроллера вертипортов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=502)
+    parser.add_argument("--id", type=lambda value: int(value, 0), default=0x01)
+    parser.add_argument("--count", type=int, default=1, help="число эмуляторов")
+    parser.add_argument("--aliases", action="store_true", help="эмуляторы на адресах 127.0.1.x вместо соседних портов")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответов, с")
+    parser.add_argument("--loss", type=float, default=0.0, help="доля теряемых кадров")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="вероятность обрыва после кадра")
+    parser.add_argument("--read-delay", type=float, default=0.0, help="пауза между чтениями из сокета, с")
+    parser.add_argument("--seed", type=int, default=None)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
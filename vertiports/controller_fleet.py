@@ -0,0 +1,202 @@
+import asyncio
+import copy
+import logging
+import threading
+from async_led_controller import AsyncSTMLedController
+from protocol import VERTIPORTS_COUNT, Ack, validateCommand
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class ControllerFleet:
+    """Набор контроллеров вертипортов на одном цикле событий в фоновом потоке.
+
+    Контроллеры (AsyncSTMLedController) хранятся по IP и находятся также по ID
+    устройства из WhoIAm. Подключение, переподключение и отправка выполняются
+    одним циклом, поэтому сцена на десятки площадок уходит параллельно, а не
+    последовательными блокирующими подключениями.
+
+    Площадкой, которой уже управляет другой объект (например, ControllerWorker
+    выбранного оператором контроллера), парк не подключается сам: attach()
+    передаёт сцены для неё владельцу через его applyAll(), так что у каждой
+    площадки одна таблица портов и один фильтр повторов. Успехом для такой
+    площадки считается только подключённый контроллер владельца (target.led).
+
+    Цели команд: None - все контроллеры, строка - IP или имя группы,
+    число - ID устройства, список - объединение целей. Методы можно вызывать
+    из любого потока: состояние парка меняется только в его цикле, а методы
+    возвращают concurrent.futures.Future.
+    """
+
+    class Attached:
+        """Площадка под управлением внешнего владельца с потокобезопасным applyAll(commands) и контроллером led."""
+        def __init__(self, target, deviceId=-1):
+            self.target = target
+            self.deviceId = deviceId
+
+        @property
+        def connected(self):
+            led = getattr(self.target, 'led', None)
+            return bool(led and led.connected)
+
+        async def applyAll(self, commands):
+            """Передаёт команды владельцу; успех - только при подключённом контроллере владельца."""
+            self.target.applyAll(commands)  # Без соединения владелец восстановит порты при переподключении
+            return self.connected
+
+        async def disconnect(self):
+            pass  # Соединением распоряжается владелец
+
+    def __init__(self, port=502, **options):
+        self.port = port
+        self.options = options  # Параметры каждого AsyncSTMLedController; backoff копируется для каждого
+        self.controllers = {}  # IP -> AsyncSTMLedController или Attached
+        self.groups = {}  # Имя группы -> цели
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        """Запускает цикл событий контроллеров в фоновом потоке."""
+        if self.thread is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Отключает все контроллеры и останавливает поток."""
+        if self.thread is None:
+            return
+        self._call(self._removeAll()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def add(self, ip, port=None):
+        """Добавляет контроллер и подключается к нему; Future с признаком подключения."""
+        return self._call(self._add(ip, port or self.port))
+
+    def addAll(self, ips, port=None):
+        """Подключается ко всем адресам одновременно; Future с {ip: подключён}."""
+        return self._call(self._gather({ip: self._add(ip, port or self.port) for ip in ips}))
+
+    def remove(self, ip):
+        """Отключает контроллер и убирает его из набора."""
+        return self._call(self._remove(ip))
+
+    def attach(self, ip, target, deviceId=-1):
+        """Передаёт площадку внешнему владельцу target; собственное подключение парка к ней закрывается."""
+        return self._call(self._attach(ip, target, deviceId))
+
+    def detach(self, ip):
+        """Убирает площадку внешнего владельца из набора."""
+        return self._call(self._detach(ip))
+
+    def setGroup(self, name, targets):
+        """Задаёт группу контроллеров; цели разрешаются при каждой команде."""
+        return self._call(self._setGroup(name, list(targets)))
+
+    def deviceIds(self):
+        """Future с ID устройств по IP (-1 - устройство ещё не ответило)."""
+        return self._call(self._deviceIds())
+
+    def applyScene(self, commands, targets=None, confirm=False):
+        """Применяет команды (id, status, r, g, b) ко всем целям параллельно; Future с {ip: успех}.
+
+        confirm=True дожидается подтверждения каждой команды, иначе - только записи в сокет.
+        """
+        commands = list(commands)
+        for command in commands:
+            validateCommand(*command)
+        return self._call(self._applyScene(commands, targets, confirm))
+
+    def broadcast(self, status, r, g, b, targets=None, confirm=False):
+        """Одинаковое состояние всех портов всех целей, например статичный белый на всех площадках."""
+        return self.applyScene([(id, status, r, g, b) for id in range(VERTIPORTS_COUNT)], targets, confirm)
+
+    async def _add(self, ip, port):
+        controller = self.controllers.get(ip)
+        if isinstance(controller, self.Attached):
+            return True  # Площадкой управляет владелец
+        if controller is None:
+            options = dict(self.options)
+            if options.get('backoff'):
+                options['backoff'] = copy.copy(options['backoff'])
+            controller = AsyncSTMLedController(ip, port, **options)
+            self.controllers[ip] = controller
+        elif controller.connected:
+            return True
+        return await controller.connect()
+
+    async def _remove(self, ip):
+        controller = self.controllers.pop(ip, None)
+        if controller:
+            await controller.disconnect()
+
+    async def _attach(self, ip, target, deviceId):
+        attached = self.controllers.get(ip)
+        if isinstance(attached, self.Attached) and attached.target is target:
+            attached.deviceId = deviceId if deviceId != -1 else attached.deviceId
+            return
+        await self._remove(ip)
+        self.controllers[ip] = self.Attached(target, deviceId)
+
+    async def _detach(self, ip):
+        if isinstance(self.controllers.get(ip), self.Attached):
+            del self.controllers[ip]
+
+    async def _setGroup(self, name, targets):
+        self.groups[name] = targets
+
+    async def _deviceIds(self):
+        return {ip: controller.deviceId for ip, controller in self.controllers.items()}
+
+    async def _removeAll(self):
+        await asyncio.gather(*(self._remove(ip) for ip in list(self.controllers)))
+
+    async def _gather(self, coroutines):
+        """Выполняет сопрограммы параллельно; {ключ: результат}, ошибка считается неуспехом."""
+        results = await asyncio.gather(*coroutines.values(), return_exceptions=True)
+        for key, result in zip(coroutines, results):
+            if isinstance(result, Exception):
+                logging.error(f"Fleet operation on {key} failed: {result}")
+        return {key: result is True for key, result in zip(coroutines, results)}
+
+    async def _applyScene(self, commands, targets, confirm):
+        controllers = self._resolve(targets)
+        if confirm:
+            return await self._gather({ip: self._confirmed(controller, commands)
+                                       for ip, controller in controllers.items()})
+        return await self._gather({ip: controller.applyAll(commands) for ip, controller in controllers.items()})
+
+    async def _confirmed(self, controller, commands):
+        if isinstance(controller, self.Attached):
+            return await controller.applyAll(commands)  # Подтверждения собирает владелец
+        responses = await controller.sendAll(commands)
+        return all(isinstance(response, Ack) for response in responses)
+
+    def _resolve(self, targets, seen=()):
+        """Разрешает цели в {ip: контроллер}; неизвестная цель - KeyError."""
+        if targets is None:
+            return dict(self.controllers)
+        if isinstance(targets, str) and targets in self.groups:
+            if targets in seen:
+                raise ValueError(f"Group {targets} includes itself")
+            return self._resolve(self.groups[targets], (*seen, targets))
+        if isinstance(targets, str):
+            if targets not in self.controllers:
+                raise KeyError(f"Unknown controller {targets}")
+            return {targets: self.controllers[targets]}
+        if isinstance(targets, int):
+            found = {ip: controller for ip, controller in self.controllers.items() if controller.deviceId == targets}
+            if not found:
+                raise KeyError(f"No controller with device ID {hex(targets)}")
+            return found
+        controllers = {}
+        for target in targets:
+            controllers.update(self._resolve(target, seen))
+        return controllers
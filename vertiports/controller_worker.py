@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+import logging
+from PyQt6.QtCore import QObject, pyqtSignal
+from led_controller import STMLedController
+from protocol import VERTIPORT_COMMAND, VERTIPORT_FRAME_SIZE, VERTIPORT_STRUCT, VERTIPORTS_COUNT, validateCommand
+from scheduler import Scheduler
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class ControllerWorker(QObject):
+    """Поток ввода-вывода, единолично владеющий STMLedController.
+
+    Все операции с сокетом (подключение, WhoIAm, отправка, переподключение)
+    выполняются в этом потоке. GUI только ставит команды в потокобезопасную
+    очередь, а результаты получает сигналами Qt.
+
+    Команды портов объединяются по принципу "побеждает последняя": для каждого
+    порта хранится только самая новая ожидающая команда - кадром протокола в
+    слоте порта заранее выделенного буфера, а сброс на сокет происходит не чаще
+    maxFlushRate раз в секунду одной записью этих кадров. Буферов два: пока
+    один отправляется, в другой пишутся новые команды.
+
+    Переподключение контроллера с нарастающей задержкой выполняется планировщиком,
+    который прокачивается этим же потоком; каждый переход состояния соединения
+    передаётся в statusChanged ("backoff:<секунды>" для ожидания повторной попытки).
+    """
+
+    statusChanged = pyqtSignal(str)
+    deviceIdentified = pyqtSignal(str, int)
+
+    def __init__(self, parent=None, maxFlushRate=30, minColorDelta=1):
+        super().__init__(parent)
+        self.commands = queue.Queue()
+        self.pendingLock = threading.Lock()
+        self.pendingFrames = bytearray(VERTIPORTS_COUNT * VERTIPORT_FRAME_SIZE)  # Слот кадра каждого порта
+        self.pendingPorts = set()  # Порты с ожидающей командой в pendingFrames
+        self.flushFrames = bytearray(len(self.pendingFrames))  # Буфер отправляемого сброса
+        self.flushPorts = set()
+        self.maxFlushRate = maxFlushRate
+        self.minColorDelta = minColorDelta  # Порог изменения цвета, ниже которого порт не переотправляется
+        self.flushInterval = 1.0 / maxFlushRate
+        self.lastFlush = 0.0
+        self.led = None
+        self.thread = None
+        self.scheduler = Scheduler(wakeup=self._wake)
+
+    def start(self):
+        """Запускает поток ввода-вывода."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Отключается от контроллера и завершает поток."""
+        if self.thread is not None:
+            self.commands.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def connectTo(self, ip, port):
+        """Ставит в очередь подключение к контроллеру."""
+        self.commands.put((self._connect, (ip, port)))
+
+    def changeVertiport(self, id, status, r, g, b):
+        """Запоминает изменение параметров порта, вытесняя ещё не отправленную команду этого порта."""
+        self.applyAll([(id, status, r, g, b)])
+
+    def applyAll(self, commands):
+        """Запоминает набор команд (id, status, r, g, b), например кадр эффекта; уходят одним сбросом."""
+        commands = list(commands)
+        for command in commands:
+            validateCommand(*command)  # Ошибку получает вызывающий, а не поток ввода-вывода
+        with self.pendingLock:
+            wake = not self.pendingPorts
+            for id, status, r, g, b in commands:
+                VERTIPORT_STRUCT.pack_into(self.pendingFrames, id * VERTIPORT_FRAME_SIZE,
+                                           VERTIPORT_COMMAND, id, status, r, g, b)
+                self.pendingPorts.add(id)
+        if wake:
+            self.commands.put(())  # Будим поток, если он ждёт без таймаута
+
+    def applyEncoded(self, data):
+        """Запоминает закодированные кадры команд портов, копируя их в слоты портов без разбора."""
+        view = memoryview(data)
+        if len(view) % VERTIPORT_FRAME_SIZE:
+            raise ValueError(f"Encoded commands must be whole {VERTIPORT_FRAME_SIZE}-byte frames, got {len(view)} bytes")
+        for offset in range(0, len(view), VERTIPORT_FRAME_SIZE):
+            if view[offset] != VERTIPORT_COMMAND or view[offset + 1] >= VERTIPORTS_COUNT:
+                raise ValueError(f"Not a vertiport command frame at offset {offset}")
+        with self.pendingLock:
+            wake = not self.pendingPorts
+            for offset in range(0, len(view), VERTIPORT_FRAME_SIZE):
+                slot = view[offset + 1] * VERTIPORT_FRAME_SIZE
+                self.pendingFrames[slot:slot + VERTIPORT_FRAME_SIZE] = view[offset:offset + VERTIPORT_FRAME_SIZE]
+                self.pendingPorts.add(view[offset + 1])
+        if wake:
+            self.commands.put(())
+
+    def disconnect(self):
+        """Ставит в очередь отключение от контроллера."""
+        self.commands.put((self._disconnect, ()))
+
+    def _wake(self):
+        self.commands.put(())
+
+    def _run(self):
+        while True:
+            delays = [d for d in (self.scheduler.runDue(), self._flushDelay()) if d is not None]
+            try:
+                item = self.commands.get(timeout=min(delays) if delays else None)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                handler, args = item
+                try:
+                    handler(*args)
+                except Exception as e:
+                    logging.error(f"Controller command failed: {e}")
+            self._flushIfDue()
+        self._disconnect()
+
+    def _onStateChanged(self, controller):
+        """Сообщает GUI о переходе состояния соединения."""
+        if self.led not in (None, controller):
+            return  # Событие от контроллера, который уже заменён
+        if controller.state == controller.CONNECTED:
+            self.deviceIdentified.emit(controller.ip, controller.deviceId)
+        if controller.state == controller.BACKOFF:
+            self.statusChanged.emit(f"{controller.state}:{controller.retryIn:.1f}")
+        else:
+            self.statusChanged.emit(controller.state)
+
+    def _connect(self, ip, port):
+        self._disconnect()
+        self.led = STMLedController(ip, port, scheduler=self.scheduler, onStateChanged=self._onStateChanged,
+                                    minColorDelta=self.minColorDelta)
+
+    def _flushDelay(self):
+        """Время до разрешённого сброса ожидающих команд или None, если их нет."""
+        with self.pendingLock:
+            if not self.pendingPorts:
+                return None
+        return max(self.lastFlush + self.flushInterval - time.monotonic(), 0)
+
+    def _flushIfDue(self):
+        """Отправляет накопленные команды портов, если истёк интервал ограничения частоты."""
+        if self._flushDelay() != 0:
+            return
+        with self.pendingLock:
+            self.pendingFrames, self.flushFrames = self.flushFrames, self.pendingFrames
+            self.pendingPorts, self.flushPorts = self.flushPorts, self.pendingPorts
+        self.lastFlush = time.monotonic()
+        # Кадры ожидающих портов сдвигаются к началу буфера по порядку портов: одна непрерывная запись
+        view = memoryview(self.flushFrames)
+        size = 0
+        for id in range(VERTIPORTS_COUNT):
+            if id in self.flushPorts:
+                slot = id * VERTIPORT_FRAME_SIZE
+                if slot != size:
+                    view[size:size + VERTIPORT_FRAME_SIZE] = view[slot:slot + VERTIPORT_FRAME_SIZE]
+                size += VERTIPORT_FRAME_SIZE
+        self.flushPorts.clear()
+        if self.led:  # Без подключения команды не отправляются
+            self.led.applyEncoded(view[:size])
+
+    def _disconnect(self):
+        if self.led:
+            self.led.disconnect()
+            self.led = None
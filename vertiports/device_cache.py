@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+import logging
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.vertiports', 'devices.json')
+
+
+class DeviceCache:
+    """Реестр найденных контроллеров, сохраняемый между запусками.
+
+    Для каждого IP хранит ID из WhoIAm, время последнего ответа и RTT.
+    Записи старше ttl секунд считаются устаревшими и отбрасываются. Реестр
+    обновляется и при поиске, и фоновым наблюдением (PresenceMonitor):
+    переставшие отвечать адреса опрашиваются последними.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.saveLock = threading.Lock()  # Сохраняют и поиск, и фоновое наблюдение
+        self.entries = {}
+        self.load()
+
+    def _isFresh(self, entry, now):
+        return now - entry["lastSeen"] <= self.ttl
+
+    def load(self):
+        """Загружает реестр с диска, пропуская устаревшие записи."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to load device cache {self.path}: {e}")
+            return
+        now = time.time()
+        with self.lock:
+            self.entries = {e["ip"]: e for e in entries if self._isFresh(e, now)}
+
+    def save(self):
+        """Атомарно сохраняет реестр на диск."""
+        with self.saveLock:
+            with self.lock:
+                entries = list(self.entries.values())
+            tmpPath = self.path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmpPath, 'w', encoding='utf-8') as f:
+                    json.dump(entries, f, indent=2)
+                os.replace(tmpPath, self.path)
+            except OSError as e:
+                logging.warning(f"Failed to save device cache {self.path}: {e}")
+
+    def update(self, ip, deviceId, rtt):
+        """Обновляет запись по ответу устройства."""
+        with self.lock:
+            self.entries[ip] = {"ip": ip, "deviceId": deviceId, "lastSeen": time.time(), "rtt": rtt}
+
+    def demote(self, ip):
+        """Отмечает, что устройство перестало отвечать: до следующего ответа адрес опрашивается последним."""
+        with self.lock:
+            entry = self.entries.get(ip)
+            if entry:
+                entry["lastFailed"] = time.time()
+
+    def _answering(self, entry):
+        return entry.get("lastFailed", 0) <= entry["lastSeen"]
+
+    def rtts(self):
+        """Возвращает сохранённые RTT для начальной оценки таймаутов."""
+        with self.lock:
+            return [e["rtt"] for e in self.entries.values() if e.get("rtt") is not None]
+
+    def addresses(self):
+        """Возвращает актуальные адреса, начиная с последних ответивших; переставшие отвечать - в конце."""
+        now = time.time()
+        with self.lock:
+            fresh = [e for e in self.entries.values() if self._isFresh(e, now)]
+        return [e["ip"] for e in sorted(fresh, key=lambda e: (not self._answering(e), -e["lastSeen"]))]
@@ -2,8 +2,16 @@ import socket
 import threading
 import logging
 import platform
+import ipaddress
+import itertools
+import re
+import subprocess
+import time
 from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot
-from concurrent.futures import ThreadPoolExecutor
+from protocol import WHO_I_AM_REQUEST
+from scan_engine import AsyncScanEngine, SelectorScanEngine, ScanSession, UdpDiscovery
+from device_cache import DeviceCache
+from rtt_estimator import RttEstimator
 
 try:
     import psutil
@@ -18,13 +26,42 @@ except ImportError:
 # Настройка логирования
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# OUI сетевых интерфейсов STM32 (MAC по умолчанию 00:80:E1:xx:xx:xx)
+CONTROLLER_OUIS = ("00:80:e1",)
+
+# Строка вывода `arp -a`: IP и MAC в форматах Windows (00-11-..) и macOS/BSD (0:11:..)
+ARP_LINE_PATTERN = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3})\D+?((?:[0-9a-fA-F]{1,2}[:-]){5}[0-9a-fA-F]{1,2})")
+
+# Доступные движки сканирования
+SCAN_BACKENDS = {
+    "asyncio": AsyncScanEngine,
+    "selector": SelectorScanEngine,
+}
+
 class DeviceScanner(QObject):
     deviceFound = pyqtSignal(str)
     scanCompleted = pyqtSignal(bool)
+    progress = pyqtSignal(int, int)
 
-    def __init__(self, port=502, parent=None):
+    def __init__(self, port=502, parent=None, concurrency=256, connectTimeout=0.3, handshakeTimeout=0.3,
+                 backend="asyncio", rateLimit=2000, interfaces=None, maxPrefix=20, cache=None,
+                 controllerOuis=CONTROLLER_OUIS, stopOnFirst=False, udpDiscovery=True):
         super().__init__(parent)
         self.port = port
+        self.stopOnFirst = stopOnFirst  # Завершать сканирование на первом найденном устройстве
+        self.session = None
+        self.sessionLock = threading.Lock()
+        self.controllerOuis = tuple(oui.lower() for oui in controllerOuis)
+        self.cache = cache if cache is not None else DeviceCache()
+        self.rttEstimator = RttEstimator(floor=0.05, ceiling=1.0)
+        for rtt in self.cache.rtts():
+            self.rttEstimator.addSample(rtt)
+        self.interfaces = interfaces  # Имена интерфейсов для сканирования (None - все)
+        self.maxPrefix = maxPrefix  # Сети шире этого префикса сужаются вокруг локального адреса
+        self.engine = SCAN_BACKENDS[backend](port=port, concurrency=concurrency, connectTimeout=connectTimeout,
+                                             handshakeTimeout=handshakeTimeout, rateLimit=rateLimit,
+                                             rttEstimator=self.rttEstimator)
+        self.udpDiscovery = UdpDiscovery(port=port) if udpDiscovery else None
 
     def sendRequest(self, ip):
         """Отправляет запрос на указанный IP-адрес и возвращает его, если устройство найдено."""
@@ -32,7 +69,7 @@ class DeviceScanner(QObject):
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.settimeout(1)
                 s.connect((ip, self.port))
-                s.sendall(bytes([0x42, 0x42, 0x00, 0xff]))
+                s.sendall(WHO_I_AM_REQUEST)
                 data = s.recv(1024)
                 if data:
                     logging.info(f"Device found at {ip}:{self.port}")
@@ -59,39 +96,178 @@ class DeviceScanner(QObject):
                             return ip
         return socket.gethostbyname(socket.gethostname())
 
-    def _getLocalIpBase(self):
-        """Возвращает базовую часть локального IP-адреса."""
-        localIp = self._getLocalIp()
-        if not localIp:
-            logging.error("Unable to determine local IP address.")
-            return None
-        return '.'.join(localIp.split('.')[:-1])
-
-    def scanNetwork(self):
-        """Сканирует сеть в поисках устройств."""
-        foundDevices = []
-
-        def scanIp(ip):
-            deviceIp = self.sendRequest(ip)
-            if deviceIp:
-                foundDevices.append(deviceIp)
-                self.deviceFound.emit(deviceIp)
-
-        baseIp = self._getLocalIpBase()
-        if not baseIp:
-            logging.error("No valid network base for scanning.")
-            self.scanCompleted.emit(False)
+    def _getLocalNetworks(self):
+        """Возвращает список (интерфейс, IPv4Interface) с реальными масками активных интерфейсов."""
+        networks = []
+        if psutil:
+            stats = psutil.net_if_stats()
+            for interface, addrs in psutil.net_if_addrs().items():
+                if interface in stats and not stats[interface].isup:
+                    continue
+                for addr in addrs:
+                    if addr.family == socket.AF_INET and addr.netmask:
+                        networks.append((interface, ipaddress.IPv4Interface(f"{addr.address}/{addr.netmask}")))
+        elif netifaces:
+            for interface in netifaces.interfaces():
+                for addr in netifaces.ifaddresses(interface).get(netifaces.AF_INET, []):
+                    if addr.get('netmask'):
+                        networks.append((interface, ipaddress.IPv4Interface(f"{addr['addr']}/{addr['netmask']}")))
+        networks = [(name, iface) for name, iface in networks if not iface.ip.is_loopback]
+        if not networks:
+            localIp = self._getLocalIp()
+            if localIp and not localIp.startswith('127.'):
+                networks.append(("default", ipaddress.IPv4Interface(f"{localIp}/24")))
+        if self.interfaces is not None:
+            return [(name, iface) for name, iface in networks if name in self.interfaces]
+        return [(name, iface) for name, iface in networks if not iface.ip.is_link_local]
+
+    def _buildTargets(self, networks):
+        """Строит список адресов для опроса: сети чередуются, дубликаты и свои адреса исключены."""
+        ownIps = {iface.ip for _, iface in networks}
+        perNetwork = []
+        for name, iface in networks:
+            network = iface.network
+            if network.prefixlen < self.maxPrefix:
+                logging.warning(f"{name}: {network} is too large, scanning {iface.ip}/{self.maxPrefix} only")
+                network = ipaddress.IPv4Interface(f"{iface.ip}/{self.maxPrefix}").network
+            perNetwork.append(network.hosts())
+        targets = []
+        seen = set(ownIps)
+        for ip in itertools.chain.from_iterable(itertools.zip_longest(*perNetwork)):
+            if ip is not None and ip not in seen:
+                seen.add(ip)
+                targets.append(str(ip))
+        return targets
+
+    def _getDefaultGateway(self):
+        """Возвращает IPv4-адрес шлюза по умолчанию или None."""
+        if netifaces:
+            gateway = netifaces.gateways().get('default', {}).get(netifaces.AF_INET)
+            if gateway:
+                return gateway[0]
+        if platform.system() == "Linux":
+            try:
+                with open('/proc/net/route') as f:
+                    for line in f.readlines()[1:]:
+                        fields = line.split()
+                        if len(fields) >= 3 and fields[1] == '00000000':
+                            return socket.inet_ntoa(int(fields[2], 16).to_bytes(4, 'little'))
+            except OSError:
+                pass
+        return None
+
+    def _measureGatewayRtt(self):
+        """Замеряет RTT до шлюза TCP-подключением: принятое соединение и RST одинаково дают круг."""
+        gateway = self._getDefaultGateway()
+        if not gateway:
+            return
+        start = time.monotonic()
+        try:
+            with socket.create_connection((gateway, self.port), timeout=self.rttEstimator.ceiling):
+                pass
+        except ConnectionRefusedError:
+            pass
+        except OSError:
             return
+        rtt = time.monotonic() - start
+        self.rttEstimator.addSample(rtt)
+        logging.info(f"Gateway {gateway} RTT: {rtt * 1000:.1f} ms")
+
+    def _getNeighbors(self):
+        """Читает таблицу соседей ОС и возвращает {ip: mac} для живых записей."""
+        neighbors = {}
+        try:
+            if platform.system() == "Linux":
+                with open('/proc/net/arp') as f:
+                    for line in f.readlines()[1:]:
+                        fields = line.split()
+                        if len(fields) >= 4 and fields[2] != '0x0':  # 0x0 - незавершённая запись
+                            neighbors[fields[0]] = fields[3].lower()
+            else:
+                output = subprocess.run(["arp", "-a"], capture_output=True, text=True, timeout=2).stdout
+                for ip, mac in ARP_LINE_PATTERN.findall(output):
+                    neighbors[ip] = ':'.join(part.zfill(2) for part in re.split('[:-]', mac.lower()))
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.warning(f"Unable to read neighbor table: {e}")
+        return {ip: mac for ip, mac in neighbors.items() if mac not in ('00:00:00:00:00:00', 'ff:ff:ff:ff:ff:ff')}
+
+    def _orderTargets(self, hosts, neighbors):
+        """Упорядочивает адреса: сначала соседи с OUI контроллера, затем прочие соседи, затем остальные."""
+        def rank(ip):
+            mac = neighbors.get(ip)
+            if mac is None:
+                return 2
+            return 0 if mac.startswith(self.controllerOuis) else 1
+        return sorted(hosts, key=rank)
+
+    def _onProbeFound(self, result, known=None):
+        """Передаёт найденное устройство из цикла событий сканера в Qt (один раз за сеанс)."""
+        if known is not None:
+            if result.ip in known:
+                return
+            known.add(result.ip)
+        logging.info(f"Device found at {result.ip}:{self.port} (id={hex(result.deviceId)}, rtt={result.rtt * 1000:.1f} ms)")
+        self.cache.update(result.ip, result.deviceId, result.rtt)
+        self.deviceFound.emit(result.ip)
+
+    def scanNetwork(self, session=None):
+        """Сканирует сеть в поисках устройств.
 
-        logging.info(f"Scanning network base: {baseIp}.x")
-        with ThreadPoolExecutor(max_workers=254) as executor:
-            futures = [executor.submit(scanIp, f"{baseIp}.{i}") for i in range(1, 255)]
-            for future in futures:
-                future.result()
+        Сначала опрашиваются адреса из кэша, затем выполняется широковещательный
+        UDP-поиск; полный TCP-обход запускается, только если по UDP никто не ответил.
+        """
+        if session is None:
+            session = ScanSession(onProgress=self.progress.emit, stopOnFirst=self.stopOnFirst)
+        cached = self.cache.addresses()
+        networks = self._getLocalNetworks()
+        if not networks:
+            logging.error("No valid network for scanning.")
+        cachedSet = set(cached)
+        hosts = [ip for ip in self._buildTargets(networks) if ip not in cachedSet]
+        hosts = self._orderTargets(hosts, self._getNeighbors())
+        session.total = len(cached) + len(hosts)
+        if self.rttEstimator.estimate() is None:
+            self._measureGatewayRtt()
 
+        known = set()
+
+        def onFound(result):
+            self._onProbeFound(result, known)
+
+        foundDevices = self.engine.scan(cached, onFound=onFound, session=session) if cached else []
+        if foundDevices:
+            logging.info(f"Cached devices answered: {[r.ip for r in foundDevices]}")
+        if self.udpDiscovery and networks and not session.stopped:
+            broadcasts = sorted({str(iface.network.broadcast_address) for _, iface in networks})
+            udpDevices = self.udpDiscovery.discover(broadcasts, onFound=onFound, session=session)
+            if udpDevices:
+                logging.info(f"UDP discovery answered: {[r.ip for r in udpDevices]}, skipping TCP sweep")
+                foundDevices += udpDevices
+                session.advance(len(hosts))
+                hosts = []
+        if hosts and not session.stopped:
+            logging.info(f"Scanning {len(hosts)} hosts on: " + ", ".join(f"{name} {iface.network}" for name, iface in networks))
+            foundDevices += self.engine.scan(hosts, onFound=onFound, session=session)
+
+        self.cache.save()
+        if session.cancelled:
+            logging.info("Scan cancelled.")
+            return
         self.scanCompleted.emit(bool(foundDevices))
 
     @pyqtSlot()
     def startScan(self):
-        """Запускает сканирование в отдельном потоке."""
-        threading.Thread(target=self.scanNetwork).start()
+        """Запускает сканирование в отдельном потоке, отменяя предыдущее."""
+        with self.sessionLock:
+            if self.session:
+                self.session.cancel()
+            self.session = ScanSession(onProgress=self.progress.emit, stopOnFirst=self.stopOnFirst)
+            session = self.session
+        threading.Thread(target=self.scanNetwork, args=(session,), daemon=True).start()
+
+    @pyqtSlot()
+    def cancelScan(self):
+        """Отменяет текущее сканирование."""
+        with self.sessionLock:
+            if self.session:
+                self.session.cancel()
@@ -0,0 +1,288 @@
+import abc
+import colorsys
+import logging
+import math
+import threading
+import time
+from protocol import VERTIPORT_COMMAND, VERTIPORT_FRAME_SIZE, VERTIPORTS_COUNT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STATUS_STATIC = 1  # Эффект считается на компьютере, контроллер только показывает цвет
+
+
+def linear(x):
+    return x
+
+
+def easeInOut(x):
+    return x * x * (3 - 2 * x)
+
+
+def _scale(color, level):
+    return tuple(int(round(c * level)) for c in color)
+
+
+def _hsvToRgb(hue):
+    """Векторный перевод оттенков hue (насыщенность и яркость 1) в массив RGB в [0, 1]."""
+    h6 = (hue % 1.0) * 6
+    sector = numpy.floor(h6).astype(int) % 6
+    rising = h6 - numpy.floor(h6)
+    falling = 1 - rising
+    ones, zeros = numpy.ones_like(hue), numpy.zeros_like(hue)
+    return numpy.stack([numpy.choose(sector, [ones, falling, zeros, zeros, rising, ones]),
+                        numpy.choose(sector, [rising, ones, ones, falling, zeros, zeros]),
+                        numpy.choose(sector, [zeros, zeros, rising, ones, ones, falling])], axis=-1)
+
+
+class Effect(abc.ABC):
+    """Эффект: цвет порта как функция времени t (секунд с момента запуска).
+
+    colors() - векторный вариант для NumPy: массивы портов и времён -> массив (k, 3).
+    По умолчанию он вызывает color() для каждого порта.
+    """
+
+    @abc.abstractmethod
+    def color(self, port, t):
+        """Цвет (r, g, b) порта port в момент t."""
+
+    def colors(self, ports, t):
+        return numpy.array([self.color(int(port), float(at)) for port, at in zip(ports, t)], dtype=float)
+
+
+class Static(Effect):
+    def __init__(self, color):
+        self.rgb = tuple(color)
+
+    def color(self, port, t):
+        return self.rgb
+
+    def colors(self, ports, t):
+        return numpy.broadcast_to(numpy.array(self.rgb, dtype=float), (len(ports), 3))
+
+
+class Blink(Effect):
+    def __init__(self, color, period=1.0, duty=0.5):
+        self.rgb = tuple(color)
+        self.period = period
+        self.duty = duty  # Доля периода, когда порт горит
+
+    def color(self, port, t):
+        return self.rgb if t % self.period < self.duty * self.period else (0, 0, 0)
+
+    def colors(self, ports, t):
+        return numpy.outer(t % self.period < self.duty * self.period, self.rgb)
+
+
+class Wave(Effect):
+    """Бегущая волна яркости: соседние порты сдвинуты по фазе на spread периода."""
+    def __init__(self, color, period=2.0, spread=1 / 6):
+        self.rgb = tuple(color)
+        self.period = period
+        self.spread = spread
+
+    def color(self, port, t):
+        return _scale(self.rgb, 0.5 - 0.5 * math.cos(2 * math.pi * (t / self.period - port * self.spread)))
+
+    def colors(self, ports, t):
+        return numpy.outer(0.5 - 0.5 * numpy.cos(2 * numpy.pi * (t / self.period - ports * self.spread)), self.rgb)
+
+
+class Rainbow(Effect):
+    def __init__(self, period=5.0, spread=1 / 6):
+        self.period = period
+        self.spread = spread
+
+    def color(self, port, t):
+        r, g, b = colorsys.hsv_to_rgb((t / self.period + port * self.spread) % 1.0, 1.0, 1.0)
+        return _scale((r, g, b), 255)
+
+    def colors(self, ports, t):
+        return _hsvToRgb(t / self.period + ports * self.spread) * 255
+
+
+class Fade(Effect):
+    """Плавный переход между цветами за duration секунд по кривой curve."""
+    def __init__(self, start, end, duration=1.0, curve=linear):
+        self.start = tuple(start)
+        self.end = tuple(end)
+        self.duration = duration
+        self.curve = curve
+
+    def color(self, port, t):
+        level = self.curve(min(t / self.duration, 1.0)) if self.duration > 0 else 1.0
+        return tuple(int(round(a + (b - a) * level)) for a, b in zip(self.start, self.end))
+
+    def colors(self, ports, t):
+        level = self.curve(numpy.minimum(t / self.duration, 1.0)) if self.duration > 0 else numpy.ones_like(t)
+        start = numpy.array(self.start, dtype=float)
+        return start + numpy.outer(level, numpy.array(self.end, dtype=float) - start)
+
+
+class CurveEffect(Effect):
+    """Яркость по произвольной кривой curve(x) -> [0, 1], повторяемой с периодом period."""
+    def __init__(self, color, curve, period=1.0):
+        self.rgb = tuple(color)
+        self.curve = curve
+        self.period = period
+
+    def color(self, port, t):
+        return _scale(self.rgb, min(max(self.curve(t % self.period / self.period), 0.0), 1.0))
+
+
+EFFECTS = {
+    "static": Static,
+    "blink": Blink,
+    "wave": Wave,
+    "rainbow": lambda color: Rainbow(),
+    "fade": lambda color: Fade((0, 0, 0), color),
+    "pulse": lambda color: CurveEffect(color, lambda x: easeInOut(1 - abs(2 * x - 1))),
+}
+
+
+def createEffect(name, color):
+    """Создаёт эффект по имени из EFFECTS."""
+    try:
+        return EFFECTS[name](color)
+    except KeyError:
+        raise ValueError(f"Unknown effect: {name}") from None
+
+
+class EffectEngine:
+    """Вычисляет цвета портов на каждом кадре и отправляет их контроллерам.
+
+    Цель - STMLedController или ControllerWorker. Кадры идут по монотонным часам
+    с фиксированной частотой: сроки считаются от начала работы, а не от конца
+    предыдущего кадра, поэтому ошибка сна не накапливается; отставшие кадры
+    пропускаются, а не догоняются.
+
+    С NumPy кадр считается векторно: порты всех целей с одним эффектом
+    вычисляются одной операцией над массивами, цвета пишутся в буфер
+    (цели × 6 × 3) uint8, который является частью готовых кадров протокола,
+    и цели получают байты через applyEncoded(). Без NumPy цвета считаются
+    по портам и передаются в applyAll(commands). Гамма и яркость применяются
+    таблицей в обоих случаях.
+    """
+
+    def __init__(self, fps=30, gamma=1.0, brightness=1.0, vectorized=True):
+        self.interval = 1.0 / fps
+        self.vectorized = vectorized and numpy is not None
+        self.lut = [min(int(round(255 * (value / 255) ** gamma * brightness)), 255) for value in range(256)]
+        self.lutArray = numpy.array(self.lut, dtype=numpy.uint8) if numpy is not None else None
+        self.lock = threading.Lock()
+        self.effects = {}  # (цель, порт) -> (эффект, время запуска)
+        self.layout = None  # Группировка портов по эффектам для векторного расчёта; сбрасывается при изменениях
+        self.thread = None
+        self.stopEvent = threading.Event()
+        self.framesSent = 0
+        self.framesSkipped = 0
+        self.maxLateness = 0.0  # Наибольшее опоздание кадра относительно расписания
+
+    def setEffect(self, target, ports, effect):
+        """Запускает эффект на портах ports (номер или список) одной цели с общим началом отсчёта."""
+        ports = [ports] if isinstance(ports, int) else list(ports)
+        startedAt = time.monotonic()
+        with self.lock:
+            for port in ports:
+                self.effects[(target, port)] = (effect, startedAt)
+            self.layout = None
+
+    def clearEffect(self, target, ports=None):
+        """Останавливает эффекты на портах цели (на всех, если ports=None)."""
+        if isinstance(ports, int):
+            ports = [ports]
+        with self.lock:
+            for key in [key for key in self.effects if key[0] is target and (ports is None or key[1] in ports)]:
+                del self.effects[key]
+            self.layout = None
+
+    def renderFrame(self, now):
+        """Возвращает {цель: [(port, status, r, g, b), ...]} для момента now."""
+        frame = {}
+        for (target, port), (effect, startedAt) in sorted(self.effects.items(), key=lambda item: item[0][1]):
+            r, g, b = (self.lut[min(max(value, 0), 255)] for value in effect.color(port, now - startedAt))
+            frame.setdefault(target, []).append((port, STATUS_STATIC, r, g, b))
+        return frame
+
+    def _buildLayout(self):
+        targets = list(dict.fromkeys(target for target, _ in self.effects))
+        rowOf = {target: row for row, target in enumerate(targets)}
+        grouped = {}
+        for (target, port), (effect, startedAt) in self.effects.items():
+            rows, ports, starts = grouped.setdefault(effect, ([], [], []))
+            rows.append(rowOf[target])
+            ports.append(port)
+            starts.append(startedAt)
+        groups = [(effect, numpy.array(rows), numpy.array(ports), numpy.array(starts))
+                  for effect, (rows, ports, starts) in grouped.items()]
+        active = numpy.zeros((len(targets), VERTIPORTS_COUNT), dtype=bool)
+        wire = numpy.zeros((len(targets), VERTIPORTS_COUNT, VERTIPORT_FRAME_SIZE), dtype=numpy.uint8)
+        wire[:, :, 0] = VERTIPORT_COMMAND
+        wire[:, :, 1] = numpy.arange(VERTIPORTS_COUNT)
+        wire[:, :, 2] = STATUS_STATIC
+        for _, rows, ports, _ in groups:
+            active[rows, ports] = True
+        return targets, groups, active, wire
+
+    def renderBuffer(self, now):
+        """Векторно считает кадр; возвращает (цели, буфер цвета (цели × 6 × 3) uint8, маска активных портов)."""
+        if self.layout is None:
+            self.layout = self._buildLayout()
+        targets, groups, active, wire = self.layout
+        colors = wire[:, :, 3:]  # Буфер цвета - часть кадров протокола, отдельного кодирования нет
+        for effect, rows, ports, starts in groups:
+            rgb = numpy.clip(numpy.rint(effect.colors(ports, now - starts)), 0, 255).astype(numpy.uint8)
+            colors[rows, ports] = self.lutArray[rgb]
+        return targets, colors, active
+
+    def encodeFrame(self, now):
+        """Возвращает {цель: байты кадров команд её активных портов} для момента now."""
+        targets, _, active = self.renderBuffer(now)
+        wire = self.layout[3]
+        return {target: wire[row][active[row]].tobytes() for row, target in enumerate(targets)}
+
+    def _sendFrame(self, now):
+        with self.lock:
+            frame = self.encodeFrame(now) if self.vectorized else self.renderFrame(now)
+            for target, payload in frame.items():
+                try:
+                    (target.applyEncoded if self.vectorized else target.applyAll)(payload)
+                except Exception as e:
+                    logging.error(f"Effect frame failed: {e}")
+        self.framesSent += 1
+
+    def start(self):
+        """Запускает поток кадров."""
+        if self.thread is None:
+            self.stopEvent.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Останавливает поток кадров."""
+        if self.thread is not None:
+            self.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        origin = time.monotonic()
+        frame = 0
+        while True:
+            deadline = origin + frame * self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0 and self.stopEvent.wait(delay) or self.stopEvent.is_set():
+                return
+            self.maxLateness = max(self.maxLateness, time.monotonic() - deadline)
+            self._sendFrame(deadline)  # Цвета по расписанию, а не по фактическому времени: движение ровное
+            frame += 1
+            behind = int((time.monotonic() - origin) / self.interval) - frame
+            if behind > 0:
+                self.framesSkipped += behind
+                frame += behind
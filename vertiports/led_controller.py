@@ -1,12 +1,37 @@
 import socket
 import threading
 import logging
+import time
+from protocol import (VERTIPORT_FRAME_SIZE, VERTIPORT_STRUCT, WHO_I_AM_KEY, WHO_I_AM_REQUEST, Ack, CommandEncoder,
+                      DeltaFilter, Error, FrameDecoder, ResponseMatcher, commandKey, validateCommand)
+from rtt_estimator import RttEstimator
+from scheduler import Backoff, defaultScheduler
 
 # Настройка логирования
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class STMLedController:
-    """Класс для управления RGB лентами через TCP-контроллер."""
+    """Класс для управления RGB лентами через TCP-контроллер.
+
+    Соединение проходит состояния disconnected -> connecting -> handshaking ->
+    connected; после неудачи контроллер ждёт в backoff с экспоненциально растущей
+    задержкой. Каждый переход передаётся в onStateChanged(controller).
+
+    Ответы контроллера разбираются потоковым FrameDecoder и сопоставляются
+    с ожидающими запросами, поэтому подтверждения команд портов собираются
+    без блокирующего чтения после каждой отправки.
+
+    Все операции с сокетом и таблицей портов выполняются под self.lock: переподключение
+    идёт в потоке планировщика и не должно пересекаться с отправкой команд.
+    """
+
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    HANDSHAKING = "handshaking"
+    CONNECTED = "connected"
+    BACKOFF = "backoff"
+
+    MAX_UNACKED = 256  # Сколько неподтверждённых команд помнить
 
     class VertiportCommand:
         """Команда управления одним портом."""
@@ -16,116 +41,337 @@ class STMLedController:
             self.g = g
             self.b = b
 
-    def __init__(self, ip=None, port=None):
+    def __init__(self, ip=None, port=None, rttEstimator=None, autoReconnect=True,
+                 scheduler=None, backoff=None, onStateChanged=None, minColorDelta=1):
         # Инициализация подключения и основных параметров
         self.ip = ip
         self.port = port
-        self.connectTimeout = 2  # Сократили время для подключения
-        self.communicator = self._createClient(ip=self.ip, port=self.port)
-        self.connected = self.communicator is not None
-        if self.connected:
-            logging.info("Connected to device: %s", hex(self._whoIAm()))
+        self.connectTimeout = 2  # Верхняя граница таймаутов, пока RTT не измерен
+        self.rttEstimator = rttEstimator or RttEstimator(floor=0.2, ceiling=self.connectTimeout)
+        self.autoReconnect = autoReconnect  # False - переподключение только явным вызовом reconnect()
+        self.scheduler = scheduler  # None - общий планировщик процесса
+        self.backoff = backoff or Backoff()
+        self.onStateChanged = onStateChanged
+        self.state = self.DISCONNECTED
+        self.retryIn = None  # Задержка до следующей попытки в состоянии backoff
+        self.reconnectHandle = None
+        self.closed = False
+        self.lock = threading.RLock()  # Сокет и таблица портов: отправка и переподключение из планировщика
+        self.communicator = None
+        self.deviceId = -1
+        self.decoder = FrameDecoder()
+        self.matcher = ResponseMatcher(limit=self.MAX_UNACKED)
+        self.rejectedCommands = 0
+        self.acksSeen = False  # Устройство хоть раз подтвердило команду: прошивка с Ack
+        self.delta = DeltaFilter(minColorDelta)  # Не отправляет порты, уже находящиеся в нужном состоянии
+        self.encoder = CommandEncoder()  # Буфер отправки, общий для всех commit()
 
         # Инициализация команд для каждого порта
         self.vertiportsCommand = [self.VertiportCommand() for _ in range(6)]
+        self.dirtyPorts = set()  # Порты, изменённые после последнего commit()
+        self.configuredPorts = set()  # Порты, для которых задано желаемое состояние
         self.lastCommand = None
         self.lastVertiportId = None
 
-        # Таймер для восстановления соединения
-        self.reconnectTimer = None
-        self.startReconnectTimer()
+        if self._open():
+            logging.info("Connected to device: %s", hex(self.deviceId))
+
+    @property
+    def connected(self):
+        return self.state == self.CONNECTED
+
+    def _setState(self, state, retryIn=None):
+        """Переводит соединение в новое состояние и сообщает об этом."""
+        self.retryIn = retryIn
+        if state == self.state:
+            return
+        logging.info(f"Controller {self.ip}:{self.port}: {self.state} -> {state}")
+        self.state = state
+        if self.onStateChanged:
+            self.onStateChanged(self)
+
+    def _open(self):
+        """Подключение и рукопожатие; при неудаче - переход в backoff."""
+        with self.lock:
+            self._setState(self.CONNECTING)
+            self.communicator = self._createClient(ip=self.ip, port=self.port)
+            if self.communicator:
+                self._setState(self.HANDSHAKING)
+                if self.restoreState():
+                    self.backoff.reset()
+                    self._setState(self.CONNECTED)
+                    return True
+            self._dropConnection()
+            return False
+
+    def _dropConnection(self):
+        """Закрывает сокет и планирует переподключение, если оно ещё не запланировано."""
+        with self.lock:
+            if self.communicator:
+                self.communicator.close()
+                self.communicator = None
+            self.decoder.reset()
+            self.matcher.clear()
+            self.delta.reset()
+            if self.closed or not self.autoReconnect:
+                self._setState(self.DISCONNECTED)
+                return
+            if self.reconnectHandle is not None:
+                return
+            delay = self.backoff.next()
+            self.reconnectHandle = (self.scheduler or defaultScheduler()).callLater(delay, self._retry)
+            self._setState(self.BACKOFF, delay)
 
-    def startReconnectTimer(self):
-        """Запуск таймера повторного подключения."""
-        if self.reconnectTimer is None or not self.reconnectTimer.is_alive():  # Исправил имя метода на is_alive
-            self.reconnectTimer = threading.Timer(5, self.reconnect)
-            self.reconnectTimer.start()
+    def _cancelReconnect(self):
+        with self.lock:
+            if self.reconnectHandle is not None:
+                self.reconnectHandle.cancel()
+                self.reconnectHandle = None
 
-    def stopReconnectTimer(self):
-        """Остановка таймера повторного подключения."""
-        if self.reconnectTimer:
-            self.reconnectTimer.cancel()
+    def _retry(self):
+        with self.lock:
+            self.reconnectHandle = None
+            if self.closed or self.communicator:
+                return
+            logging.info(f"Attempting to reconnect to {self.ip}:{self.port}")
+            if self._open():
+                logging.info("Reconnected successfully.")
 
     def _createClient(self, ip, port):
         """Создание TCP-клиента для подключения к контроллеру."""
         logging.info(f"Creating connection to {ip}:{port}")
         communicator = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        communicator.settimeout(self._timeout())
+        start = time.monotonic()
         try:
             communicator.connect((ip, port))
+            self.rttEstimator.addSample(time.monotonic() - start)
+            communicator.settimeout(self.connectTimeout)  # Запись не ограничиваем оценкой RTT
             return communicator
         except (OSError, ConnectionRefusedError) as e:
             logging.error(f"Failed to connect to {ip}:{port}: {e}")
+            communicator.close()
             return None
 
+    def _timeout(self):
+        """Таймаут операций с сокетом по измеренному RTT."""
+        return self.rttEstimator.timeout(self.connectTimeout)
+
     def _write(self, msg):
         """Отправка сообщения на контроллер."""
         if not self.communicator:
             logging.warning("Connection lost, initiating reconnect...")
-            self.startReconnectTimer()
-            return
+            self._dropConnection()
+            return False
         try:
             self.communicator.sendall(msg)
+            return True
         except (OSError, ConnectionResetError) as e:
             logging.error(f"Error sending data: {e}")
-            self.communicator = None
-            self.startReconnectTimer()
+            self._dropConnection()
+            return False
 
-    def _read(self):
-        """Чтение данных с контроллера."""
+    def _receive(self, timeout):
+        """Читает пришедшие байты и разбирает ответы; timeout=0 - без ожидания. False при разрыве."""
         if not self.communicator:
-            return -1
+            return False
         try:
-            self.communicator.settimeout(self.connectTimeout)
-            data = self.communicator.recv(1024)
-            return data if data else -1
-        except (OSError, TimeoutError):
-            return -1
+            self.communicator.settimeout(timeout)
+            count = self.communicator.recv_into(self.decoder.writable())
+        except (BlockingIOError, socket.timeout):
+            return True
+        except OSError as e:
+            logging.error(f"Error receiving data: {e}")
+            self._dropConnection()
+            return False
+        finally:
+            if self.communicator:
+                self.communicator.settimeout(self.connectTimeout)
+        if not count:
+            logging.warning("Connection closed by controller.")
+            self._dropConnection()
+            return False
+        self.decoder.advance(count)
+        for response in self.decoder.frames(self.matcher.expectations):
+            self._dispatch(response)
+        return True
+
+    def _dispatch(self, response):
+        """Передаёт ответ ожидающему его запросу."""
+        if isinstance(response, Ack):
+            self.acksSeen = True
+        waiter = self.matcher.match(response)
+        if waiter is None:
+            return
+        if isinstance(response, Error):
+            self.rejectedCommands += 1
+            logging.warning(f"Controller rejected vertiport {response.port} command, code {response.code}")
+        elif isinstance(response, Ack) and not self.matcher.expecting(response.key):
+            self.delta.markAcked(response)
+        if isinstance(waiter, list):
+            waiter.append(response)
+
+    def _awaitResponse(self, key, waiter, timeout):
+        """Читает ответы до прихода ответа для waiter или истечения timeout."""
+        deadline = time.monotonic() + timeout
+        while not waiter:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._receive(remaining):
+                self.matcher.discard(key, waiter)
+                return None
+        return waiter[0]
 
     def _whoIAm(self):
         """Определение устройства по уникальному идентификатору."""
-        if not self.communicator:
-            return -1
-        self._write(bytes([0x42, 0x42, 0x00, 0xff]))
-        response = self._read()
-        return response[0] if response != -1 else -1
+        with self.lock:
+            if not self.communicator:
+                return -1
+            start = time.monotonic()
+            waiter = self.matcher.expect(WHO_I_AM_KEY, [])
+            if not self._write(WHO_I_AM_REQUEST):
+                return -1
+            response = self._awaitResponse(WHO_I_AM_KEY, waiter, self._timeout())
+            if response is None:
+                return -1
+            self.rttEstimator.addSample(time.monotonic() - start)
+            return response.deviceId
+
+    def pollResponses(self):
+        """Разбирает уже пришедшие ответы без ожидания; возвращает число неподтверждённых запросов."""
+        with self.lock:
+            self._receive(0)
+            return self.matcher.outstanding()
+
+    def stageVertiport(self, id, status, r, g, b):
+        """Запоминает новое состояние порта в vertiportsCommand без отправки."""
+        with self.lock:
+            validateCommand(id, status, r, g, b)
+            command = self.vertiportsCommand[id]
+            command.status, command.r, command.g, command.b = status, r, g, b
+            self.dirtyPorts.add(id)
+            self.configuredPorts.add(id)
+            self.lastCommand = (id, status, r, g, b)
+            self.lastVertiportId = id
+
+    def commit(self):
+        """Отправляет все подготовленные изменения портов одним буфером (один sendall)."""
+        with self.lock:
+            if not self.dirtyPorts:
+                return True
+            self.pollResponses()  # Забираем подтверждения прошлых команд, не давая им копиться в сокете
+            self.encoder.clear()
+            for id in sorted(self.dirtyPorts):
+                command = self.vertiportsCommand[id]
+                self._encode(id, command.status, command.r, command.g, command.b)
+            self.dirtyPorts.clear()
+            return self._write(self.encoder.view()) if len(self.encoder) else True
+
+    def _encode(self, id, status, r, g, b):
+        """Добавляет команду в буфер отправки, если она меняет подтверждённое состояние порта."""
+        if self.delta.unchanged(id, status, r, g, b):
+            return False
+        self.encoder.pack(id, status, r, g, b)
+        self.delta.markSent(id, status, r, g, b)
+        self.matcher.expect(commandKey(id, status, r, g, b))
+        return True
+
+    def applyAll(self, commands):
+        """Применяет набор команд (id, status, r, g, b) одной записью в сокет."""
+        with self.lock:
+            commands = list(commands)
+            for command in commands:
+                self.stageVertiport(*command)
+            sent = self.commit()
+            logging.debug(f"Applied {len(commands)} vertiport commands in one write")
+            return sent
+
+    def applyEncoded(self, data):
+        """Отправляет уже закодированные кадры команд портов (например, кадр эффектов) как есть, одной записью."""
+        with self.lock:
+            self.pollResponses()
+            self.encoder.clear()
+            for offset in range(0, len(data), VERTIPORT_FRAME_SIZE):
+                _, id, status, r, g, b = VERTIPORT_STRUCT.unpack_from(data, offset)
+                self.stageVertiport(id, status, r, g, b)
+                self.dirtyPorts.discard(id)
+                self._encode(id, status, r, g, b)
+            if self.encoder.size == len(data):
+                return self._write(data)  # Ничего не отсеяно - кадры уходят как есть
+            return self._write(self.encoder.view()) if len(self.encoder) else True
 
     def changeVertiport(self, id, status, r, g, b):
         """Изменение состояния и цвета для указанного порта."""
-        self.lastCommand = (id, status, r, g, b)
-        self.lastVertiportId = id
-        self._write(bytes([0x7e, id, status, r, g, b]))
-        logging.info(f"Changed vertiport {id} to status={status}, color=({r}, {g}, {b})")
+        with self.lock:
+            self.stageVertiport(id, status, r, g, b)
+            self.commit()
+            logging.info(f"Changed vertiport {id} to status={status}, color=({r}, {g}, {b})")
+
+    def restoreState(self):
+        """Сверяет ID устройства и восстанавливает на нём все заданные порты одной записью.
+
+        Таблица портов отправляется только тому же устройству, что и раньше, и
+        считается восстановленной после подтверждения каждой команды. Если
+        устройство ещё ни разу не подтверждало команды (старая прошивка без Ack),
+        проверкой служит совпавший WhoIAm, а отсутствие подтверждений - только
+        предупреждение.
+        """
+        with self.lock:
+            deviceId = self._whoIAm()
+            if deviceId == -1:
+                logging.warning("Device did not answer WhoIAm.")
+                return False
+            if self.deviceId not in (-1, deviceId):
+                logging.error(f"Device ID changed after reconnect: {hex(self.deviceId)} -> {hex(deviceId)}; "
+                              f"state is not restored")
+                return False
+            self.deviceId = deviceId
+            self.dirtyPorts |= self.configuredPorts
+            if not self.commit():
+                return False
+            if not self._awaitAcks(self._timeout()):
+                if self.acksSeen:
+                    logging.warning("Device did not confirm restored vertiports.")
+                    return False
+                logging.warning("Device does not acknowledge commands; restored vertiports are unconfirmed")
+            logging.info(f"Restored {len(self.configuredPorts)} vertiports on device {hex(deviceId)}")
+            return True
+
+    def _awaitAcks(self, timeout):
+        """Читает ответы, пока не будут подтверждены все отправленные команды; False по таймауту."""
+        deadline = time.monotonic() + timeout
+        while self.matcher.outstanding():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._receive(remaining):
+                return False
+        return True
 
     def reconnect(self):
-        """Попытка восстановления подключения."""
-        if self.communicator:
-            return
-        logging.info(f"Attempting to reconnect to {self.ip}:{self.port}")
-        self.communicator = self._createClient(self.ip, self.port)
-        if self.communicator:
-            logging.info("Reconnected successfully.")
-            self.stopReconnectTimer()
-            if self.lastCommand:
-                self.changeVertiport(*self.lastCommand)
-        else:
-            logging.warning("Reconnect failed. Retrying...")
-            self.startReconnectTimer()
+        """Немедленная попытка восстановления подключения."""
+        with self.lock:
+            if self.communicator:
+                return
+            self.closed = False
+            self._cancelReconnect()
+            self._retry()
+            if not self.connected:
+                logging.warning("Reconnect failed. Retrying...")
 
     def disconnect(self):
         """Отключение от контроллера."""
-        if self.communicator:
-            self.communicator.close()
-        self.communicator = None
-        self.stopReconnectTimer()
+        with self.lock:
+            self.closed = True
+            self._cancelReconnect()
+            self._dropConnection()
 
     def testConnection(self):
         """Тестирование соединения."""
-        if not self.communicator:
-            logging.warning("No active connection.")
-            return False
-        try:
-            self.communicator.sendall(b'\x00')
-            return True
-        except (OSError, ConnectionResetError) as e:
-            logging.error(f"Connection test failed: {e}")
-            return False
+        with self.lock:
+            if not self.communicator:
+                logging.warning("No active connection.")
+                return False
+            try:
+                self.communicator.sendall(b'\x00')
+                return True
+            except (OSError, ConnectionResetError) as e:
+                logging.error(f"Connection test failed: {e}")
+                return False
@@ -4,8 +4,11 @@ from PyQt6.QtWidgets import QApplication
 from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal
 from PyQt6.QtQml import QQmlApplicationEngine
 from PyQt6.QtGui import QIcon
-from led_controller import STMLedController
+from controller_fleet import ControllerFleet
+from controller_worker import ControllerWorker
 from device_scanner import DeviceScanner
+from effects import EffectEngine, createEffect
+from presence_monitor import PresenceMonitor
 import logging
 
 # Настройка логирования
@@ -16,11 +19,21 @@ class LedController(QObject):
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.led = None
+        self.activeIp = None
+        self.worker = ControllerWorker()
+        self.worker.statusChanged.connect(self.connectionStatusChanged)
+        self.worker.deviceIdentified.connect(self.onDeviceIdentified)
+        self.worker.start()
         self.deviceScanner = DeviceScanner()
         self.deviceScanner.deviceFound.connect(self.onDeviceFound)
         self.deviceScanner.scanCompleted.connect(self.onScanCompleted)
         self.foundDevices = []
+        self.presenceMonitor = PresenceMonitor(onChange=self.onPresenceChanged, cache=self.deviceScanner.cache)
+        self.presenceMonitor.start()
+        self.effectEngine = EffectEngine(fps=self.worker.maxFlushRate)
+        self.effectEngine.start()
+        self.fleet = ControllerFleet(port=self.deviceScanner.port)  # Найденные сканированием площадки
+        self.fleet.start()
 
     @pyqtSlot(str, int)
     def connect(self, ip, port):
@@ -31,20 +44,66 @@ class LedController(QObject):
             logging.error(f"Invalid IP address: {ip}")
             self.connectionStatusChanged.emit("disconnected")
             return
-        try:
-            self.led = STMLedController(formattedIp, port)
-            status = "connected" if self.led.connected else "disconnected"
-            self.connectionStatusChanged.emit(status)
-            logging.info(f"Connection status: {status}")
-        except Exception as e:
-            logging.error(f"Connection failed: {e}")
-            self.connectionStatusChanged.emit("disconnected")
+        if self.activeIp and self.activeIp != formattedIp:
+            self.fleet.detach(self.activeIp)  # Прежняя площадка возвращается парку, если её нашёл поиск
+            if self.activeIp in self.foundDevices:
+                self.fleet.add(self.activeIp)
+        self.activeIp = formattedIp
+        self.fleet.attach(formattedIp, self.worker)  # Выбранной площадкой управляет только рабочий поток
+        self.worker.connectTo(formattedIp, port)
+        self.presenceMonitor.watch(formattedIp)
+
+    def onDeviceIdentified(self, ip, deviceId):
+        """ID выбранной площадки - для целей сцен по ID устройства (вызывается из рабочего потока)."""
+        if ip == self.activeIp:
+            self.fleet.attach(ip, self.worker, deviceId)
 
     @pyqtSlot(int, int, int, int, int)
     def changeVertiport(self, id, status, r, g, b):
         """Изменение параметров порта."""
-        if self.led:
-            self.led.changeVertiport(id, status, r, g, b)
+        self.effectEngine.clearEffect(self.worker, id)  # Явная команда отменяет эффект на порту
+        self.worker.changeVertiport(id, status, r, g, b)
+
+    @pyqtSlot(int, str, int, int, int)
+    def setEffect(self, id, name, r, g, b):
+        """Запуск эффекта, рассчитываемого на компьютере (имя из effects.EFFECTS)."""
+        try:
+            self.effectEngine.setEffect(self.worker, id, createEffect(name, (r, g, b)))
+        except ValueError as e:
+            logging.error(str(e))
+
+    @pyqtSlot(int)
+    def clearEffect(self, id):
+        """Остановка эффекта на порту."""
+        self.effectEngine.clearEffect(self.worker, id)
+
+    @pyqtSlot(int, int, int, int)
+    def broadcast(self, status, r, g, b):
+        """Одинаковое состояние всех портов на всех найденных площадках."""
+        self.broadcastToGroup("", status, r, g, b)
+
+    @pyqtSlot(str, int, int, int, int)
+    def broadcastToGroup(self, group, status, r, g, b):
+        """Одинаковое состояние всех портов на площадках группы (пустое имя - на всех)."""
+        try:
+            self.fleet.broadcast(status, r, g, b, group or None).add_done_callback(self._onFleetResult)
+        except ValueError as e:
+            logging.error(str(e))
+
+    @pyqtSlot(str, 'QVariantList')
+    def setGroup(self, name, targets):
+        """Группа площадок по IP или ID устройства для общих сцен."""
+        self.fleet.setGroup(name, targets)
+
+    def _onFleetResult(self, future):
+        """Журналирует площадки, на которые сцена не ушла (вызывается из потока парка)."""
+        try:
+            failed = [ip for ip, applied in future.result().items() if not applied]
+        except (KeyError, ValueError) as e:
+            logging.error(f"Fleet scene failed: {e}")
+            return
+        if failed:
+            logging.warning(f"Scene not applied on {', '.join(failed)}")
 
     @pyqtSlot(str, result=bool)
     def isValidIp(self, ip):
@@ -64,10 +123,17 @@ class LedController(QObject):
         self.foundDevices.clear()
         self.deviceScanner.startScan()
 
+    @pyqtSlot()
+    def cancelScan(self):
+        """Остановка сканирования сети."""
+        self.deviceScanner.cancelScan()
+
     @pyqtSlot(str)
     def onDeviceFound(self, ip):
         """Обработка события нахождения устройства."""
         self.foundDevices.append(ip)
+        self.presenceMonitor.watch(ip)
+        self.fleet.add(ip)
         self.connectionStatusChanged.emit(f"auto_connected:{ip}")
         logging.info(f"Device found at {ip}")
         self.updateDeviceList()
@@ -79,6 +145,24 @@ class LedController(QObject):
             self.connectionStatusChanged.emit("no_devices_found")
             logging.info("No devices found.")
 
+    def onPresenceChanged(self, ip, state, rtt):
+        """Публикация изменений доступности контроллера (вызывается из потока наблюдения).
+
+        Индикатор подключения ведёт только statusChanged рабочего потока: проба
+        доступности идёт своим соединением и не говорит, куда уходят команды.
+        """
+        latency = f"{rtt * 1000:.1f}" if rtt is not None else ""
+        self.connectionStatusChanged.emit(f"presence:{ip}:{state}:{latency}")
+
+    @pyqtSlot()
+    def shutdown(self):
+        """Остановка фоновых задач при выходе из приложения."""
+        self.deviceScanner.cancelScan()
+        self.effectEngine.stop()
+        self.fleet.stop()
+        self.presenceMonitor.stop()
+        self.worker.stop()
+
     def updateDeviceList(self):
         """Обновление списка найденных устройств."""
         deviceModel = self.parent().findChild(QObject, "deviceModel")
@@ -96,6 +180,7 @@ if __name__ == "__main__":
     engine.load('qml/main.qml')
     ledController = LedController()
     engine.rootContext().setContextProperty("ledController", ledController)
+    app.aboutToQuit.connect(ledController.shutdown)
 
     if not engine.rootObjects():
         sys.exit(-1)
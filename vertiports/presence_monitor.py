@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import random
+import threading
+from scan_engine import AsyncScanEngine
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class PresenceMonitor:
+    """Фоновое наблюдение за известными контроллерами в одном цикле событий.
+
+    Каждый контроллер периодически опрашивается коротким WhoIAm. Изменения
+    доступности (up/down) и заметные изменения задержки передаются в onChange(ip, state, rtt).
+    Если задан cache (DeviceCache), ответы обновляют его записи, а пропавшие
+    устройства в нём понижаются - реестр поиска остаётся свежим между сканированиями.
+    """
+
+    UP = "up"
+    DOWN = "down"
+
+    class Target:
+        """Состояние наблюдения за одним контроллером."""
+        def __init__(self, ip):
+            self.ip = ip
+            self.state = None
+            self.rtt = None  # Сглаженная задержка
+            self.reportedRtt = None
+            self.failures = 0
+            self.task = None
+
+    def __init__(self, port=502, interval=2.0, timeout=1.0, failureThreshold=2, latencyChange=0.5, onChange=None,
+                 cache=None):
+        self.interval = interval
+        self.failureThreshold = failureThreshold  # Сколько неудач подряд означает "down"
+        self.latencyChange = latencyChange  # Относительное изменение задержки, о котором сообщаем
+        self.onChange = onChange
+        self.cache = cache
+        self.engine = AsyncScanEngine(port=port, connectTimeout=timeout, handshakeTimeout=timeout)
+        self.targets = {}
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        """Запускает цикл событий наблюдения в фоновом потоке."""
+        if self.thread:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Останавливает наблюдение и фоновый поток."""
+        if not self.thread:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
+
+    def watch(self, ip):
+        """Добавляет контроллер под наблюдение; безопасно вызывать из любого потока."""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._watch, ip)
+
+    def unwatch(self, ip):
+        """Снимает контроллер с наблюдения."""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._unwatch, ip)
+
+    def _watch(self, ip):
+        if ip not in self.targets:
+            target = self.Target(ip)
+            target.task = self.loop.create_task(self._monitor(target))
+            self.targets[ip] = target
+
+    def _unwatch(self, ip):
+        target = self.targets.pop(ip, None)
+        if target:
+            target.task.cancel()
+
+    async def _shutdown(self):
+        tasks = [target.task for target in self.targets.values()]
+        for ip in list(self.targets):
+            self._unwatch(ip)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _monitor(self, target):
+        await asyncio.sleep(random.uniform(0, self.interval))  # Разносим опросы разных контроллеров
+        while True:
+            self._update(target, await self.engine.probe(target.ip))
+            await asyncio.sleep(self.interval)
+
+    def _update(self, target, result):
+        """Обновляет состояние по результату опроса и сообщает об изменениях."""
+        if result is None:
+            target.failures += 1
+            if target.failures >= self.failureThreshold and target.state != self.DOWN:
+                target.state = self.DOWN
+                target.rtt = target.reportedRtt = None
+                if self.cache:
+                    self.cache.demote(target.ip)
+                    self.cache.save()
+                self._publish(target)
+            return
+
+        target.failures = 0
+        if self.cache:
+            self.cache.update(target.ip, result.deviceId, result.rtt)
+        target.rtt = result.rtt if target.rtt is None else 0.7 * target.rtt + 0.3 * result.rtt
+        latencyChanged = (target.reportedRtt is not None and
+                          abs(target.rtt - target.reportedRtt) > self.latencyChange * target.reportedRtt)
+        if target.state != self.UP or latencyChanged:
+            if self.cache and target.state != self.UP:
+                self.cache.save()
+            target.state = self.UP
+            target.reportedRtt = target.rtt
+            self._publish(target)
+
+    def _publish(self, target):
+        logging.info(f"Presence {target.ip}: {target.state}" +
+                     (f", rtt={target.rtt * 1000:.1f} ms" if target.rtt is not None else ""))
+        if self.onChange:
+            self.onChange(target.ip, target.state, target.rtt)
@@ -0,0 +1,312 @@
+import logging
+import struct
+from collections import defaultdict, deque, namedtuple
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Запросы к контроллеру
+WHO_I_AM_REQUEST = bytes([0x42, 0x42, 0x00, 0xff])
+VERTIPORT_COMMAND = 0x7e
+VERTIPORTS_COUNT = 6
+VERTIPORT_STRUCT = struct.Struct('6B')  # 0x7e id status r g b
+VERTIPORT_FRAME_SIZE = VERTIPORT_STRUCT.size
+
+# Ответы контроллера: первый байт - тип кадра. ACK и ERROR повторяют команду,
+# на которую отвечают, - по ней ответ сопоставляется с запросом.
+WHO_I_AM_REPLY = 0x42  # 0x42 id
+ACK = 0x06  # 0x06 port status r g b - команда порта применена
+ERROR = 0x15  # 0x15 port status r g b code - команда порта отклонена
+# Поля ответа без байта типа: разбираются unpack_from прямо из буфера приёма
+RESPONSE_STRUCTS = {WHO_I_AM_REPLY: struct.Struct('xB'), ACK: struct.Struct('x5B'), ERROR: struct.Struct('x6B')}
+RESPONSE_SIZES = {kind: unpacker.size for kind, unpacker in RESPONSE_STRUCTS.items()}
+
+ERROR_BAD_PORT = 0x01
+
+WHO_I_AM_KEY = ('whoIAm',)
+
+
+def commandKey(port, status, r, g, b):
+    """Ключ сопоставления ответов на команду порта."""
+    return ('port', port, status, r, g, b)
+
+
+class WhoIAmReply(namedtuple('WhoIAmReply', 'deviceId')):
+    """Ответ на WhoIAm с ID устройства."""
+    key = WHO_I_AM_KEY
+
+
+class Ack(namedtuple('Ack', 'port status r g b')):
+    """Подтверждение команды порта."""
+    @property
+    def key(self):
+        return commandKey(self.port, self.status, self.r, self.g, self.b)
+
+
+class Error(namedtuple('Error', 'port status r g b code')):
+    """Отказ в выполнении команды порта."""
+    @property
+    def key(self):
+        return commandKey(self.port, self.status, self.r, self.g, self.b)
+
+
+RESPONSE_TYPES = {WHO_I_AM_REPLY: WhoIAmReply, ACK: Ack, ERROR: Error}
+
+
+def validateCommand(id, status, r, g, b):
+    """Проверяет команду порта: номер порта 0-5, статус и цвет 0-255; иначе ValueError."""
+    if 0 <= id < VERTIPORTS_COUNT and 0 <= status <= 0xff and 0 <= r <= 0xff and 0 <= g <= 0xff and 0 <= b <= 0xff:
+        return
+    if not 0 <= id < VERTIPORTS_COUNT:
+        raise ValueError(f"Vertiport id must be 0-{VERTIPORTS_COUNT - 1}, got {id}")
+    raise ValueError(f"Status and color must be 0-255, got status={status}, color=({r}, {g}, {b})")
+
+
+def vertiportFrame(id, status, r, g, b):
+    """Кадр команды порта."""
+    validateCommand(id, status, r, g, b)
+    return VERTIPORT_STRUCT.pack(VERTIPORT_COMMAND, id, status, r, g, b)
+
+
+def vertiportCommands(data):
+    """Разбирает подряд идущие кадры команд портов в список (id, status, r, g, b)."""
+    return [frame[1:] for frame in VERTIPORT_STRUCT.iter_unpack(data)]
+
+
+class CommandEncoder:
+    """Кодирует команды портов подряд в один заранее выделенный буфер.
+
+    pack() пишет кадр через pack_into по текущему смещению, view() отдаёт
+    закодированную часть без копирования. После clear() буфер используется
+    заново и увеличивается, только если команд больше, чем помещалось раньше.
+    """
+
+    def __init__(self, capacity=VERTIPORTS_COUNT):
+        self.buffer = bytearray(capacity * VERTIPORT_FRAME_SIZE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size // VERTIPORT_FRAME_SIZE
+
+    def clear(self):
+        self.size = 0
+
+    def pack(self, id, status, r, g, b):
+        """Добавляет кадр команды порта."""
+        validateCommand(id, status, r, g, b)
+        if self.size + VERTIPORT_FRAME_SIZE > len(self.buffer):
+            self.buffer = self.buffer + bytearray(max(len(self.buffer), VERTIPORT_FRAME_SIZE))
+        VERTIPORT_STRUCT.pack_into(self.buffer, self.size, VERTIPORT_COMMAND, id, status, r, g, b)
+        self.size += VERTIPORT_FRAME_SIZE
+
+    def encode(self, commands):
+        """Кодирует набор команд (id, status, r, g, b) с начала буфера; возвращает view()."""
+        self.clear()
+        for command in commands:
+            self.pack(*command)
+        return self.view()
+
+    def view(self):
+        """Закодированные кадры без копирования; действительны до следующего clear()/encode()."""
+        return memoryview(self.buffer)[:self.size]
+
+
+def whoIAmDeviceId(data):
+    """ID устройства из ответа на WhoIAm; понимает и кадр 0x42 id, и одиночный байт старых прошивок."""
+    if len(data) >= RESPONSE_SIZES[WHO_I_AM_REPLY] and data[0] == WHO_I_AM_REPLY:
+        return data[1]
+    return data[0] if data else None
+
+
+class FrameDecoder:
+    """Потоковый разбор ответов контроллера.
+
+    Байты накапливаются в переиспользуемом буфере: recv_into пишет прямо в
+    writable(), а feed() копирует уже прочитанные данные. frames() выдаёт
+    готовые ответы, оставляя неполный кадр до следующего чтения. Неизвестные
+    байты пропускаются для ресинхронизации.
+
+    Старые прошивки отвечают на WhoIAm одним байтом ID без типа кадра. Такой
+    байт распознаётся, пока ожидается WhoIAm и байт не может начать ожидаемый
+    кадр: см. frames(expecting).
+    """
+
+    def __init__(self, size=1024):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def _compact(self, room):
+        """Сдвигает непрочитанные байты в начало и при необходимости увеличивает буфер."""
+        pending = self.end - self.start
+        if self.start:
+            self.view[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        if len(self.buffer) - self.end < room:
+            self.buffer = self.buffer[:pending] + bytearray(max(len(self.buffer), room))
+            self.view = memoryview(self.buffer)
+
+    def writable(self, room=1024):
+        """Свободная часть буфера для recv_into."""
+        if len(self.buffer) - self.end < room:
+            self._compact(room)
+        return self.view[self.end:]
+
+    def advance(self, count):
+        """Отмечает count байт, записанных в writable()."""
+        self.end += count
+
+    def feed(self, data):
+        """Добавляет прочитанные байты."""
+        target = self.writable(len(data))
+        target[:len(data)] = data
+        self.advance(len(data))
+
+    def frames(self, expecting=None):
+        """Выдаёт полностью принятые ответы.
+
+        expecting() -> (ждём ли WhoIAm, ждём ли ответы на команды), например
+        ResponseMatcher.expectations, включает разбор ответа WhoIAm одним байтом.
+        """
+        while self.start < self.end:
+            kind = self.buffer[self.start]
+            if expecting is not None and self._legacyWhoIAm(kind, *expecting()):
+                self.start += 1
+                yield WhoIAmReply(kind)
+                continue
+            size = RESPONSE_SIZES.get(kind)
+            if size is None:
+                logging.debug(f"Skipping unexpected byte {hex(kind)}")
+                self.start += 1
+                continue
+            if self.end - self.start < size:
+                break
+            response = RESPONSE_TYPES[kind]._make(RESPONSE_STRUCTS[kind].unpack_from(self.buffer, self.start))
+            self.start += size
+            yield response
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def _legacyWhoIAm(self, kind, whoIAm, commands):
+        """Является ли байт kind ответом WhoIAm старой прошивки (одиночным ID)."""
+        if not whoIAm or kind == WHO_I_AM_REPLY:
+            return False  # ID 0x42 неотличим от начала кадра 0x42 id
+        if kind not in RESPONSE_SIZES:
+            return True
+        # ID 0x06 или 0x15: без ожидающих команд это не начало Ack/Error, если за ним ничего не пришло
+        return not commands and self.end - self.start == 1
+
+    def reset(self):
+        """Отбрасывает накопленные байты после разрыва соединения."""
+        self.start = self.end = 0
+
+
+class ResponseMatcher:
+    """Сопоставление ответов с ожидающими запросами.
+
+    Ожидания хранятся очередью по ключу ответа, поэтому ответы на несколько
+    отправленных подряд одинаковых команд разбираются по порядку. Ответ без
+    ожидающего запроса (например, опоздавший после таймаута) отбрасывается.
+    limit ограничивает общее число ожиданий (прошивка без подтверждений не
+    должна приводить к росту памяти): вытесняются ожидания самого старого ключа.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.pending = defaultdict(deque)
+        self.count = 0
+
+    def expect(self, key, waiter=None):
+        """Регистрирует ожидание ответа с ключом key; возвращает waiter."""
+        waiter = waiter if waiter is not None else object()
+        if self.limit and self.count >= self.limit:
+            oldestKey = next(iter(self.pending))
+            self.discard(oldestKey, self.pending[oldestKey][0])
+        self.pending[key].append(waiter)
+        self.count += 1
+        return waiter
+
+    def discard(self, key, waiter):
+        """Снимает ожидание, например после таймаута."""
+        waiters = self.pending.get(key, ())
+        for index, pending in enumerate(waiters):
+            if pending is waiter:
+                del waiters[index]
+                self.count -= 1
+                if not waiters:
+                    del self.pending[key]
+                return
+
+    def match(self, response):
+        """Возвращает самое раннее ожидание для ответа или None."""
+        waiters = self.pending.get(response.key)
+        if not waiters:
+            logging.debug(f"Unsolicited response {response}")
+            return None
+        waiter = waiters.popleft()
+        self.count -= 1
+        if not waiters:
+            del self.pending[response.key]
+        return waiter
+
+    def expectations(self):
+        """(ждём ли ответ на WhoIAm, ждём ли ответы на команды портов)."""
+        whoIAm = WHO_I_AM_KEY in self.pending
+        return whoIAm, len(self.pending) > whoIAm
+
+    def expecting(self, key):
+        """Есть ли ещё ожидания ответа с ключом key."""
+        return key in self.pending
+
+    def outstanding(self):
+        """Число запросов, ожидающих ответа."""
+        return self.count
+
+    def clear(self):
+        """Снимает все ожидания и возвращает их."""
+        waiters = [waiter for queue in self.pending.values() for waiter in queue]
+        self.pending.clear()
+        self.count = 0
+        return waiters
+
+
+class DeltaFilter:
+    """Отсеивает команды портов, не меняющие подтверждённое состояние устройства.
+
+    Для каждого порта хранится последняя отправленная команда и признак её
+    подтверждения. Команда пропускается, только если последняя отправленная
+    подтверждена, статус совпадает, а каждый канал цвета отличается меньше
+    чем на minColorDelta (1 - пропускаются только точные повторы, 0 - фильтр
+    выключен). Без подтверждений (старая прошивка, разрыв) ничего не пропускается.
+    """
+
+    def __init__(self, minColorDelta=1, count=VERTIPORTS_COUNT):
+        self.minColorDelta = minColorDelta
+        self.sent = [None] * count  # (status, r, g, b) последней отправленной команды порта
+        self.acked = [False] * count
+        self.skipped = 0
+
+    def unchanged(self, id, status, r, g, b):
+        """True, если команду можно не отправлять; учитывает её в skipped."""
+        sent = self.sent[id]
+        if not self.acked[id] or sent[0] != status:
+            return False
+        if max(abs(r - sent[1]), abs(g - sent[2]), abs(b - sent[3])) >= self.minColorDelta:
+            return False
+        self.skipped += 1
+        return True
+
+    def markSent(self, id, status, r, g, b):
+        """Отмечает отправку команды порта."""
+        self.sent[id] = (status, r, g, b)
+        self.acked[id] = False
+
+    def markAcked(self, ack):
+        """Отмечает подтверждение; засчитывается только для последней отправленной команды порта."""
+        if ack.port < len(self.sent) and self.sent[ack.port] == (ack.status, ack.r, ack.g, ack.b):
+            self.acked[ack.port] = True
+
+    def reset(self):
+        """Забывает подтверждения: после переподключения состояние устройства неизвестно."""
+        self.acked = [False] * len(self.acked)
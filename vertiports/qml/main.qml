@@ -116,7 +116,16 @@ Window {
                 Connections {
                     target: ledController
                     function onConnectionStatusChanged(newStatus) {  // Используем новый синтаксис для Connections
-                        connectionIndicator.color = newStatus === "connected" ? "green" : "red";
+                        if (newStatus.startsWith("presence:")) {
+                            return;  // Фоновые сведения о доступности не меняют индикатор напрямую
+                        }
+                        if (newStatus === "connected") {
+                            connectionIndicator.color = "green";
+                        } else if (newStatus === "connecting" || newStatus === "handshaking" || newStatus.startsWith("backoff:")) {
+                            connectionIndicator.color = "orange";  // Идёт подключение или ожидание повторной попытки
+                        } else {
+                            connectionIndicator.color = "red";
+                        }
                         if (newStatus === "device_found") {
                             enterIPAdress.text = newStatus;
                         } else if (newStatus === "no_devices_found") {
@@ -319,8 +328,13 @@ Window {
                             var g = Math.round(selectedColor.g * 255);
                             var b = Math.round(selectedColor.b * 255);
 
+                            var effects = ["", "", "blink", "wave", "rainbow"];
                             var status = modeComboBox.currentIndex;
-                            ledController.changeVertiport(index, status, r, g, b);  // Исправил имя метода на changeVertiport
+                            if (effects[status] !== "") {
+                                ledController.setEffect(index, effects[status], r, g, b);  // Эффект считается на компьютере
+                            } else {
+                                ledController.changeVertiport(index, status, r, g, b);  // Явная команда отменяет эффект на порту
+                            }
                         }
                     }
                 }
@@ -0,0 +1,39 @@
+import threading
+from collections import deque
+
+
+class RttEstimator:
+    """Оценка времени отклика сети по скользящему окну замеров.
+
+    Таймаут считается как перцентиль RTT, умноженный на запас, и ограничивается
+    снизу floor и сверху ceiling. Пока замеров нет, используется значение по умолчанию.
+    """
+
+    def __init__(self, percentile=0.95, multiplier=4.0, floor=0.05, ceiling=2.0, window=64):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def addSample(self, rtt):
+        """Добавляет замер RTT в секундах."""
+        if rtt is not None and rtt >= 0:
+            with self.lock:
+                self.samples.append(rtt)
+
+    def estimate(self):
+        """Возвращает перцентиль RTT по окну или None, если замеров нет."""
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+
+    def timeout(self, default=None):
+        """Возвращает таймаут на основе оценки RTT в пределах [floor, ceiling]."""
+        rtt = self.estimate()
+        if rtt is None:
+            return default if default is not None else self.ceiling
+        return min(max(rtt * self.multiplier, self.floor), self.ceiling)
@@ -0,0 +1,401 @@
+import asyncio
+import errno
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import threading
+import time
+from protocol import WHO_I_AM_REQUEST, whoIAmDeviceId
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Коды возврата connect_ex для неблокирующего сокета, означающие "соединение устанавливается"
+_CONNECT_IN_PROGRESS = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                        getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)}
+
+
+class ProbeResult:
+    """Результат опроса одного адреса."""
+    def __init__(self, ip, deviceId, rtt):
+        self.ip = ip
+        self.deviceId = deviceId
+        self.rtt = rtt
+
+    def __repr__(self):
+        return f"ProbeResult(ip={self.ip!r}, deviceId={self.deviceId!r}, rtt={self.rtt:.4f})"
+
+
+def _adaptiveTimeout(rttEstimator, default):
+    """Таймаут по оценке RTT, если она задана, иначе фиксированное значение."""
+    return rttEstimator.timeout(default) if rttEstimator else default
+
+
+class ScanSession:
+    """Сеанс сканирования: отмена из другого потока, прогресс и остановка на первом устройстве."""
+
+    def __init__(self, total=0, onProgress=None, stopOnFirst=False, progressStep=0.01):
+        self.total = total
+        self.done = 0
+        self.onProgress = onProgress
+        self.stopOnFirst = stopOnFirst
+        self.progressStep = progressStep  # Минимальная доля адресов между уведомлениями о прогрессе
+        self.cancelled = False
+        self.stopEvent = threading.Event()
+        self.lastReported = 0
+        self.lock = threading.Lock()
+
+    @property
+    def stopped(self):
+        """Сканирование нужно прекратить: сеанс отменён или найдено первое устройство."""
+        return self.stopEvent.is_set()
+
+    def cancel(self):
+        """Отменяет сеанс; безопасно вызывать из любого потока."""
+        self.cancelled = True
+        self.stopEvent.set()
+
+    def deviceFound(self):
+        """Отмечает находку; в режиме stopOnFirst останавливает сеанс."""
+        if self.stopOnFirst:
+            self.stopEvent.set()
+
+    def advance(self, count=1):
+        """Учитывает опрошенные адреса и прореживает уведомления о прогрессе."""
+        with self.lock:
+            self.done += count
+            step = max(int(self.total * self.progressStep), 1)
+            if self.done - self.lastReported < step and self.done < self.total:
+                return
+            self.lastReported = self.done
+            done = self.done
+        if self.onProgress:
+            self.onProgress(done, self.total)
+
+
+class RatePacer:
+    """Равномерно распределяет запуски опросов: не более rate в секунду (None - без ограничения)."""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.nextSlot = 0.0
+
+    def delay(self):
+        """Время до ближайшего свободного слота."""
+        return max(self.nextSlot - time.monotonic(), 0.0)
+
+    def reserve(self):
+        """Резервирует слот и возвращает задержку до него."""
+        now = time.monotonic()
+        slot = max(now, self.nextSlot)
+        self.nextSlot = slot + self.interval
+        return slot - now
+
+
+class AsyncScanEngine:
+    """Асинхронный сканер сети в два этапа в одном потоке.
+
+    Этап 1 - быстрый неблокирующий connect по всем адресам. Этап 2 - рукопожатие
+    WhoIAm только с адресами, принявшими соединение, со своим коротким таймаутом.
+    Соединение, открытое на этапе 1, передаётся этапу 2 без повторного connect.
+    """
+
+    def __init__(self, port=502, concurrency=256, connectTimeout=0.3, handshakeTimeout=0.3,
+                 handshakeConcurrency=32, rateLimit=None, rttEstimator=None):
+        self.port = port
+        self.concurrency = concurrency  # Максимум одновременных connect на этапе 1
+        self.connectTimeout = connectTimeout  # Таймауты по умолчанию, пока нет замеров RTT
+        self.handshakeTimeout = handshakeTimeout
+        self.handshakeConcurrency = handshakeConcurrency
+        self.rateLimit = rateLimit  # Общий предел новых connect в секунду
+        self.rttEstimator = rttEstimator
+
+    async def connect(self, ip):
+        """Этап 1: открывает TCP-соединение, возвращает (reader, writer) или None."""
+        start = time.monotonic()
+        try:
+            streams = await asyncio.wait_for(asyncio.open_connection(ip, self.port),
+                                             _adaptiveTimeout(self.rttEstimator, self.connectTimeout))
+        except ConnectionRefusedError:
+            streams = None  # RST - тоже полный круг до хоста
+        except (OSError, asyncio.TimeoutError):
+            return None
+        if self.rttEstimator:
+            self.rttEstimator.addSample(time.monotonic() - start)
+        return streams
+
+    async def handshake(self, ip, reader, writer):
+        """Этап 2: выполняет WhoIAm на открытом соединении и закрывает его."""
+        start = time.monotonic()
+        try:
+            writer.write(WHO_I_AM_REQUEST)
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(1024),
+                                          _adaptiveTimeout(self.rttEstimator, self.handshakeTimeout))
+        except (OSError, asyncio.TimeoutError):
+            data = b''
+        finally:
+            writer.close()
+        if not data:
+            return None
+        rtt = time.monotonic() - start
+        if self.rttEstimator:
+            self.rttEstimator.addSample(rtt)
+        return ProbeResult(ip, whoIAmDeviceId(data), rtt)
+
+    async def probe(self, ip):
+        """Опрашивает один адрес обоими этапами."""
+        streams = await self.connect(ip)
+        if streams is None:
+            return None
+        return await self.handshake(ip, *streams)
+
+    async def _watchSession(self, session, tasks):
+        """Прерывает задачи сканирования, как только сеанс остановлен."""
+        while not session.stopped:
+            await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+
+    async def scanAsync(self, hosts, onFound=None, session=None):
+        """Сканирует адреса: пул connect-сопрограмм передаёт открытые порты пулу рукопожатий."""
+        session = session or ScanSession()
+        found = []
+        pending = iter(hosts)
+        accepted = asyncio.Queue()
+        pacer = RatePacer(self.rateLimit)
+
+        async def connectWorker():
+            for ip in pending:
+                if session.stopped:
+                    return
+                delay = pacer.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                streams = await self.connect(ip)
+                if streams is None:
+                    session.advance()
+                else:
+                    accepted.put_nowait((ip, streams))
+
+        async def handshakeWorker():
+            while True:
+                item = await accepted.get()
+                if item is None:
+                    return
+                ip, streams = item
+                result = await self.handshake(ip, *streams)
+                session.advance()
+                if result and not session.stopped:
+                    found.append(result)
+                    if onFound:
+                        onFound(result)
+                    session.deviceFound()
+
+        connectors = [asyncio.create_task(connectWorker()) for _ in range(self.concurrency)]
+        handshakers = [asyncio.create_task(handshakeWorker()) for _ in range(self.handshakeConcurrency)]
+        watcher = asyncio.create_task(self._watchSession(session, connectors + handshakers))
+        await asyncio.wait(connectors)
+        for _ in handshakers:
+            accepted.put_nowait(None)
+        await asyncio.wait(handshakers)
+        watcher.cancel()
+        while not accepted.empty():
+            item = accepted.get_nowait()
+            if item is not None:
+                item[1][1].close()  # Соединение, не дошедшее до рукопожатия из-за остановки
+        for task in connectors + handshakers:
+            if not task.cancelled() and task.exception():
+                raise task.exception()
+        return found
+
+    def scan(self, hosts, onFound=None, session=None):
+        """Запускает сканирование в собственном цикле событий вызывающего потока."""
+        return asyncio.run(self.scanAsync(hosts, onFound, session))
+
+
+class SelectorScanEngine:
+    """Однопоточный сканер на selectors (epoll/kqueue/select) с кучей дедлайнов.
+
+    Одновременно открыто не более concurrency сокетов; каждый опрос снимается
+    сразу после ответа, отказа или истечения своего дедлайна. Интерфейс scan()
+    совпадает с AsyncScanEngine.
+    """
+
+    class Probe:
+        """Состояние опроса одного адреса."""
+        CONNECTING = 0
+        HANDSHAKING = 1
+
+        def __init__(self, ip, sock, deadline):
+            self.ip = ip
+            self.sock = sock
+            self.stage = self.CONNECTING
+            self.deadline = deadline
+            self.startedAt = time.monotonic()
+            self.sentAt = None
+            self.done = False
+
+    STOP_POLL_INTERVAL = 0.05  # Как часто цикл проверяет остановку сеанса
+
+    def __init__(self, port=502, concurrency=256, connectTimeout=0.3, handshakeTimeout=0.3, rateLimit=None,
+                 rttEstimator=None):
+        self.port = port
+        self.concurrency = concurrency  # Ограничивает число открытых дескрипторов
+        self.connectTimeout = connectTimeout  # Таймауты по умолчанию, пока нет замеров RTT
+        self.handshakeTimeout = handshakeTimeout
+        self.rateLimit = rateLimit  # Общий предел новых connect в секунду
+        self.rttEstimator = rttEstimator
+
+    def _start(self, ip, selector, deadlines, sequence):
+        """Начинает неблокирующий connect; возвращает Probe или None при немедленном отказе."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            err = sock.connect_ex((ip, self.port))
+        except OSError:
+            err = -1
+        if err not in _CONNECT_IN_PROGRESS:
+            sock.close()
+            return None
+        probe = self.Probe(ip, sock, time.monotonic() + _adaptiveTimeout(self.rttEstimator, self.connectTimeout))
+        selector.register(sock, selectors.EVENT_WRITE, probe)
+        heapq.heappush(deadlines, (probe.deadline, next(sequence), probe))
+        return probe
+
+    def _retire(self, probe, selector):
+        """Снимает опрос: отписывает и закрывает сокет."""
+        probe.done = True
+        selector.unregister(probe.sock)
+        probe.sock.close()
+
+    def _advance(self, probe, selector, deadlines, sequence):
+        """Обрабатывает готовность сокета; возвращает ProbeResult, True (опрос продолжается) или None."""
+        if probe.stage == self.Probe.CONNECTING:
+            err = probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if self.rttEstimator and err in (0, errno.ECONNREFUSED):
+                self.rttEstimator.addSample(time.monotonic() - probe.startedAt)
+            if err:
+                return None
+            try:
+                probe.sock.send(WHO_I_AM_REQUEST)
+            except OSError:
+                return None
+            probe.stage = self.Probe.HANDSHAKING
+            probe.sentAt = time.monotonic()
+            probe.deadline = probe.sentAt + _adaptiveTimeout(self.rttEstimator, self.handshakeTimeout)
+            selector.modify(probe.sock, selectors.EVENT_READ, probe)
+            heapq.heappush(deadlines, (probe.deadline, next(sequence), probe))
+            return True
+        try:
+            data = probe.sock.recv(1024)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return None
+        if not data:
+            return None
+        rtt = time.monotonic() - probe.sentAt
+        if self.rttEstimator:
+            self.rttEstimator.addSample(rtt)
+        return ProbeResult(probe.ip, whoIAmDeviceId(data), rtt)
+
+    def scan(self, hosts, onFound=None, session=None):
+        """Сканирует адреса в вызывающем потоке и возвращает список ProbeResult."""
+        session = session or ScanSession()
+        found = []
+        pending = iter(hosts)
+        nextIp = next(pending, None)
+        pacer = RatePacer(self.rateLimit)
+        sequence = itertools.count()
+        deadlines = []
+        active = 0
+        selector = selectors.DefaultSelector()
+        try:
+            while not session.stopped:
+                while nextIp is not None and active < self.concurrency and not pacer.delay():
+                    pacer.reserve()
+                    if self._start(nextIp, selector, deadlines, sequence):
+                        active += 1
+                    nextIp = next(pending, None)
+                if not active and nextIp is None:
+                    break
+
+                if not active:
+                    # Все опросы завершены, ждём слот ограничителя; select() без сокетов на Windows падает
+                    deadlines.clear()
+                    session.stopEvent.wait(pacer.delay())
+                    continue
+
+                timeouts = [deadlines[0][0] - time.monotonic(), self.STOP_POLL_INTERVAL]
+                if nextIp is not None and active < self.concurrency:
+                    timeouts.append(pacer.delay())
+                timeout = max(min(timeouts), 0)
+                for key, _ in selector.select(timeout):
+                    probe = key.data
+                    outcome = self._advance(probe, selector, deadlines, sequence)
+                    if outcome is True:
+                        continue
+                    self._retire(probe, selector)
+                    active -= 1
+                    session.advance()
+                    if outcome and not session.stopped:
+                        found.append(outcome)
+                        if onFound:
+                            onFound(outcome)
+                        session.deviceFound()
+
+                now = time.monotonic()
+                while deadlines and deadlines[0][0] <= now:
+                    deadline, _, probe = heapq.heappop(deadlines)
+                    if probe.done or probe.deadline != deadline:
+                        continue  # Устаревшая запись: опрос завершён или перешёл на этап 2
+                    self._retire(probe, selector)
+                    active -= 1
+                    session.advance()
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        return found
+
+
+class UdpDiscovery:
+    """Широковещательный поиск: один датаграммный WhoIAm на broadcast-адрес, сбор ответов за окно."""
+
+    def __init__(self, port=502, window=0.3):
+        self.port = port
+        self.window = window  # Сколько секунд ждать ответов после рассылки
+
+    def discover(self, broadcasts, onFound=None, session=None):
+        """Рассылает WhoIAm на адреса broadcasts и возвращает список ProbeResult ответивших."""
+        session = session or ScanSession()
+        found = {}
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sentAt = time.monotonic()
+            for address in broadcasts:
+                try:
+                    sock.sendto(WHO_I_AM_REQUEST, (address, self.port))
+                except OSError as e:
+                    logging.warning(f"UDP discovery to {address} failed: {e}")
+            deadline = sentAt + self.window
+            while not session.stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data, (ip, _) = sock.recvfrom(1024)
+                except socket.timeout:
+                    break
+                except OSError:
+                    continue  # ICMP port unreachable на Windows приходит как ошибка recvfrom
+                if not data or ip in found:
+                    continue
+                found[ip] = ProbeResult(ip, whoIAmDeviceId(data), time.monotonic() - sentAt)
+                if onFound:
+                    onFound(found[ip])
+                session.deviceFound()
+        return list(found.values())
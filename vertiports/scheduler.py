@@ -0,0 +1,132 @@
+import heapq
+import logging
+import random
+import threading
+import time
+
+# Настройка логирования
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class Backoff:
+    """Экспоненциальная задержка между попытками со случайным разбросом и верхней границей."""
+
+    def __init__(self, initial=0.5, factor=2.0, maximum=30.0, jitter=0.5):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter  # Доля задержки, на которую она может быть случайно уменьшена
+        self.attempts = 0
+
+    def next(self):
+        """Возвращает задержку перед следующей попыткой."""
+        delay = min(self.initial * self.factor ** self.attempts, self.maximum)
+        if delay < self.maximum:
+            self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        """Сбрасывает счётчик попыток после успешного подключения."""
+        self.attempts = 0
+
+
+class Scheduler:
+    """Планировщик отложенных вызовов на куче сроков.
+
+    Работает либо в собственном потоке (start/stop), либо прокачивается владельцем
+    через runDue() - например, потоком ввода-вывода между командами. wakeup
+    вызывается, когда появился вызов раньше всех запланированных.
+    """
+
+    class Handle:
+        """Запланированный вызов."""
+        def __init__(self, when, callback, args):
+            self.when = when
+            self.callback = callback
+            self.args = args
+            self.cancelled = False
+
+        def __lt__(self, other):
+            return self.when < other.when
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self, wakeup=None):
+        self.wakeup = wakeup
+        self.heap = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def callLater(self, delay, callback, *args):
+        """Планирует callback(*args) через delay секунд; возвращает Handle для отмены."""
+        handle = self.Handle(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, handle)
+            earliest = self.heap[0] is handle
+            self.condition.notify()
+        if earliest and self.wakeup:
+            self.wakeup()
+        return handle
+
+    def _nextDelay(self):
+        """Время до ближайшего вызова или None; вызывается под condition."""
+        while self.heap and self.heap[0].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return self.heap[0].when - time.monotonic()
+
+    def runDue(self):
+        """Выполняет наступившие вызовы; возвращает время до следующего или None."""
+        while True:
+            with self.condition:
+                delay = self._nextDelay()
+                if delay is None or delay > 0:
+                    return delay
+                handle = heapq.heappop(self.heap)
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                logging.error(f"Scheduled call failed: {e}")
+
+    def start(self):
+        """Запускает собственный поток планировщика."""
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Останавливает поток планировщика."""
+        if self.thread is not None:
+            with self.condition:
+                self.running = False
+                self.condition.notify()
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while True:
+            self.runDue()
+            with self.condition:
+                if not self.running:
+                    return
+                delay = self._nextDelay()
+                if delay is None or delay > 0:
+                    self.condition.wait(delay)
+
+
+_defaultScheduler = None
+_defaultSchedulerLock = threading.Lock()
+
+
+def defaultScheduler():
+    """Общий планировщик процесса с одним фоновым потоком."""
+    global _defaultScheduler
+    with _defaultSchedulerLock:
+        if _defaultScheduler is None:
+            _defaultScheduler = Scheduler()
+            _defaultScheduler.start()
+        return _defaultScheduler
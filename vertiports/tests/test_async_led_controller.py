@@ -0,0 +1,184 @@
+import asyncio
+import unittest
+from async_led_controller import AsyncSTMLedController, CommandSuperseded
+from controller_emulator import ControllerEmulator
+from protocol import Ack
+from scheduler import Backoff
+
+class TestAsyncSTMLedController(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.emulator = ControllerEmulator(port=0, deviceId=0x21, udp=False)
+        await self.emulator.start()
+        self.states = []
+        self.controller = AsyncSTMLedController('127.0.0.1', self.emulator.port,
+                                                backoff=Backoff(initial=0.05, maximum=0.2),
+                                                onStateChanged=lambda c: self.states.append(c.state))
+
+    async def asyncTearDown(self):
+        await self.controller.disconnect()
+        await self.emulator.stop()
+
+    async def waitFor(self, condition, timeout=2.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        return condition()
+
+    async def testConnectAndChangeVertiport(self):
+        self.assertTrue(await self.controller.connect())
+        self.assertEqual(self.controller.deviceId, 0x21)
+        await self.controller.changeVertiport(4, 2, 1, 2, 3)
+        self.assertTrue(await self.waitFor(lambda: self.emulator.ports[4] == (2, 1, 2, 3)))
+
+    async def testManyControllersShareOneLoop(self):
+        emulators = [ControllerEmulator(port=0, deviceId=i, udp=False) for i in range(10)]
+        await asyncio.gather(*(e.start() for e in emulators))
+        controllers = [AsyncSTMLedController('127.0.0.1', e.port) for e in emulators]
+        try:
+            self.assertTrue(all(await asyncio.gather(*(c.connect() for c in controllers))))
+            self.assertEqual([c.deviceId for c in controllers], list(range(10)))
+        finally:
+            await asyncio.gather(*(c.disconnect() for c in controllers))
+            await asyncio.gather(*(e.stop() for e in emulators))
+
+    async def testReconnectRestoresAllConfiguredPorts(self):
+        port = self.emulator.port
+        await self.emulator.stop()
+        self.assertFalse(await self.controller.connect())
+        await self.controller.changeVertiport(1, 1, 9, 9, 9)
+        await self.controller.changeVertiport(5, 3, 7, 7, 7)
+        self.emulator = ControllerEmulator(port=port, deviceId=0x21, udp=False)
+        await self.emulator.start()
+        self.assertTrue(await self.waitFor(lambda: self.emulator.ports[5] == (3, 7, 7, 7)))
+        self.assertEqual(self.emulator.ports[1], (1, 9, 9, 9))
+        self.assertEqual(self.emulator.ports[0], (0, 0, 0, 0))  # Незаданные порты не трогаем
+        self.assertTrue(await self.waitFor(lambda: self.controller.deviceId == 0x21))
+
+    async def testRestoreWaitsForAcksAndChecksDevice(self):
+        self.assertTrue(await self.controller.connect())
+        await self.controller.applyAll([(1, 1, 9, 9, 9)])
+        self.emulator.ports = [(0, 0, 0, 0)] * 6
+        self.controller._closeStreams()
+        self.assertTrue(await self.controller._open())
+        self.assertTrue(await self.controller.restoreState())
+        self.assertEqual(self.emulator.ports[1], (1, 9, 9, 9))  # Подтверждено до возврата
+        port = self.emulator.port
+        self.controller._closeStreams()
+        await self.emulator.stop()
+        self.emulator = ControllerEmulator(port=port, deviceId=0x22, udp=False)
+        await self.emulator.start()
+        self.assertTrue(await self.controller._open())
+        self.assertFalse(await self.controller.restoreState())
+        self.assertEqual(self.emulator.commandsReceived, 0)
+
+    async def testReconnectsToFirmwareWithoutAcks(self):
+        port = self.emulator.port
+        await self.emulator.stop()
+        self.emulator = ControllerEmulator(port=port, deviceId=0x21, udp=False, acks=False)
+        await self.emulator.start()
+        self.assertTrue(await self.controller.connect())
+        await self.controller.changeVertiport(2, 1, 3, 4, 5)
+        await self.emulator.stop()
+        self.assertTrue(await self.waitFor(lambda: not self.controller.connected))
+        self.emulator = ControllerEmulator(port=port, deviceId=0x21, udp=False, acks=False)
+        await self.emulator.start()
+        self.assertTrue(await self.waitFor(lambda: self.controller.connected, timeout=5))
+        self.assertEqual(self.emulator.ports[2], (1, 3, 4, 5))
+        self.assertFalse(self.controller.acksSeen)
+
+    async def testLegacyWhoIAmReplyIsAccepted(self):
+        for deviceId in (0x07, 0x06, 0x15):
+            emulator = ControllerEmulator(port=0, deviceId=deviceId, udp=False, framedWhoIAm=False)
+            await emulator.start()
+            controller = AsyncSTMLedController('127.0.0.1', emulator.port)
+            self.assertTrue(await controller.connect())
+            self.assertEqual(controller.deviceId, deviceId)
+            self.assertIsInstance(await (await controller.send(1, 1, 2, 3, 4)), Ack)
+            await controller.disconnect()
+            await emulator.stop()
+
+    async def testBackoffStatesAndSingleConnection(self):
+        port = self.emulator.port
+        await self.emulator.stop()
+        self.assertFalse(await self.controller.connect())
+        self.assertTrue(await self.waitFor(lambda: self.controller.state == AsyncSTMLedController.BACKOFF))
+        self.emulator = ControllerEmulator(port=port, deviceId=0x21, udp=False)
+        await self.emulator.start()
+        self.assertTrue(await self.controller.connect())  # Например, площадку нашли повторно
+        self.assertTrue(self.controller.reconnectTask is None or self.controller.reconnectTask.done())
+        await asyncio.sleep(0.3)
+        self.assertEqual(len(self.emulator.clients), 1)
+        self.assertEqual(self.states[-3:], [AsyncSTMLedController.CONNECTING, AsyncSTMLedController.HANDSHAKING,
+                                            AsyncSTMLedController.CONNECTED])
+
+    async def testConnectRestoresTableOfDroppedController(self):
+        self.assertTrue(await self.controller.connect())
+        await self.controller.applyAll([(2, 1, 4, 5, 6)])
+        await self.controller.disconnect()
+        self.emulator.ports = [(0, 0, 0, 0)] * 6
+        self.assertTrue(await self.controller.connect())
+        self.assertEqual(self.emulator.ports[2], (1, 4, 5, 6))
+
+    async def testSendAllResolvesAcks(self):
+        self.assertTrue(await self.controller.connect())
+        self.controller.delta.minColorDelta = 0  # Повторы должны уходить на устройство
+        acks = await self.controller.sendAll([(id, 1, id, 0, 0) for id in range(6)] * 5)
+        self.assertEqual(len(acks), 30)
+        self.assertEqual(acks[-1], Ack(5, 1, 5, 0, 0))
+        self.assertEqual(self.emulator.commandsReceived, 30)
+
+    async def testAcknowledgedStateIsNotResent(self):
+        self.assertTrue(await self.controller.connect())
+        await self.controller.sendAll([(id, 1, 50, 50, 50) for id in range(6)])
+        acks = await self.controller.sendAll([(id, 1, 50, 50, 50) for id in range(6)])
+        self.assertEqual(acks[2], Ack(2, 1, 50, 50, 50))
+        await self.controller.changeVertiport(3, 1, 50, 50, 50)
+        await self.controller.changeVertiport(4, 1, 60, 50, 50)
+        self.assertTrue(await self.waitFor(lambda: self.emulator.ports[4] == (1, 60, 50, 50)))
+        self.assertEqual(self.emulator.commandsReceived, 7)
+        self.assertEqual(self.controller.delta.skipped, 7)
+
+    async def testSupersededCommandIsNotRetransmitted(self):
+        self.controller.ackTimeout = 0.05
+        self.assertTrue(await self.controller.connect())
+        self.emulator.loss = 1.0
+        red = await self.controller.send(0, 1, 255, 0, 0)
+        self.assertTrue(await self.waitFor(lambda: self.emulator.framesLost == 1))
+        self.emulator.loss = 0.0
+        self.assertEqual(await (await self.controller.send(0, 1, 0, 0, 255)), Ack(0, 1, 0, 0, 255))
+        with self.assertRaises(CommandSuperseded):
+            await red
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.emulator.ports[0], (1, 0, 0, 255))
+        self.assertEqual(self.controller.delta.sent[0], (1, 0, 0, 255))
+
+    async def testRetransmitsUntilRetriesExhausted(self):
+        await self.emulator.stop()
+        self.emulator = ControllerEmulator(port=0, deviceId=0x21, udp=False, acks=False)
+        await self.emulator.start()
+        controller = AsyncSTMLedController('127.0.0.1', self.emulator.port, ackTimeout=0.02, retries=2)
+        try:
+            self.assertTrue(await controller.connect())
+            future = await controller.send(0, 1, 2, 3, 4)
+            with self.assertRaises(asyncio.TimeoutError):
+                await future
+            self.assertEqual(self.emulator.commandsReceived, 3)
+        finally:
+            await controller.disconnect()
+
+    async def testWindowLimitsCommandsInFlight(self):
+        await self.emulator.stop()
+        self.emulator = ControllerEmulator(port=0, deviceId=0x21, udp=False, acks=False)
+        await self.emulator.start()
+        controller = AsyncSTMLedController('127.0.0.1', self.emulator.port, window=2, ackTimeout=10)
+        try:
+            self.assertTrue(await controller.connect())
+            await controller.send(0, 1, 0, 0, 0)
+            await controller.send(1, 1, 0, 0, 0)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(controller.send(2, 1, 0, 0, 0), 0.1)
+        finally:
+            await controller.disconnect()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import tempfile
+import unittest
+from benchmark import benchmarkCommands, benchmarkFleet, benchmarkScan, compareResults
+
+def report(**values):
+    return {"metrics": {name: {"value": value, "unit": "s", "better": "higher" if "throughput" in name else "lower"}
+                        for name, value in values.items()}}
+
+class TestCompareResults(unittest.TestCase):
+    def testDetectsRegressionsInBothDirections(self):
+        baseline = report(scan=1.0, throughput=1000.0)
+        self.assertEqual(compareResults(report(scan=1.1, throughput=900.0), baseline), [])
+        self.assertEqual(compareResults(report(scan=1.5, throughput=700.0), baseline),
+                         [("scan", 1.0, 1.5), ("throughput", 1000.0, 700.0)])
+
+    def testIgnoresMetricsMissingFromBaseline(self):
+        self.assertEqual(compareResults(report(scan=5.0), report()), [])
+
+class TestBenchmarkScan(unittest.TestCase):
+    def testSmallSubnet(self):
+        with tempfile.TemporaryDirectory() as cacheDir:
+            metrics = benchmarkScan(28, cacheDir)
+        self.assertLessEqual(metrics["scan/28/first_device"]["value"], metrics["scan/28/complete"]["value"])
+
+class TestBenchmarkCommands(unittest.TestCase):
+    def testLatencyIsMeasuredPerCommand(self):
+        metrics = benchmarkCommands(200)
+        for name in ("STMLedController", "AsyncSTMLedController"):
+            self.assertGreater(metrics[f"commands/{name}/throughput"]["value"], 0)
+            self.assertLessEqual(metrics[f"commands/{name}/p50"]["value"], metrics[f"commands/{name}/p99"]["value"])
+            self.assertGreater(metrics[f"commands/{name}/p50"]["value"], 0)
+
+class TestBenchmarkFleet(unittest.TestCase):
+    def testSceneAcrossControllers(self):
+        metrics = benchmarkFleet(5, rounds=2)
+        self.assertEqual(set(metrics), {"fleet/5/connect", "fleet/5/scene"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+import unittest
+from async_led_controller import AsyncSTMLedController
+from controller_emulator import ControllerEmulator, EmulatorFleet
+from protocol import WHO_I_AM_REQUEST, vertiportFrame
+from scan_engine import AsyncScanEngine
+
+class TestControllerEmulator(unittest.IsolatedAsyncioTestCase):
+    async def startEmulator(self, **options):
+        self.emulator = ControllerEmulator(port=0, deviceId=0x31, udp=False, seed=1, **options)
+        await self.emulator.start()
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.emulator.port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.emulator.stop()
+
+    async def testLatencyDelaysRepliesInOrder(self):
+        await self.startEmulator(latency=0.05)
+        start = time.monotonic()
+        self.writer.write(WHO_I_AM_REQUEST + vertiportFrame(0, 1, 2, 3, 4))
+        reply = await self.reader.readexactly(8)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(reply, bytes([0x42, 0x31, 0x06, 0, 1, 2, 3, 4]))
+
+    async def testLossDropsFrames(self):
+        await self.startEmulator(loss=1.0)
+        self.writer.write(vertiportFrame(0, 1, 2, 3, 4))
+        await self.writer.drain()
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.reader.read(1), 0.05)
+        self.assertEqual((self.emulator.commandsReceived, self.emulator.framesLost), (0, 1))
+
+    async def testDisconnectAfterFrame(self):
+        await self.startEmulator(disconnectRate=1.0)
+        self.writer.write(vertiportFrame(0, 1, 2, 3, 4) * 3)
+        try:
+            reply = await asyncio.wait_for(self.reader.read(), 1.0)  # Читает до разрыва
+        except ConnectionResetError:
+            reply = b''
+        self.assertLessEqual(len(reply), 6)  # Подтверждение только первого кадра
+        self.assertEqual((self.emulator.commandsReceived, self.emulator.disconnects), (1, 1))
+
+    async def testSlowReadsStillDeliverAllFrames(self):
+        await self.startEmulator(readSize=6, readDelay=0.01)
+        self.writer.write(b''.join(vertiportFrame(id, 1, id, 0, 0) for id in range(6)))
+        await self.reader.readexactly(6 * 6)
+        self.assertEqual(self.emulator.ports[5], (1, 5, 0, 0))
+
+    async def testPipelineRecoversFromLoss(self):
+        await self.startEmulator()
+        controller = AsyncSTMLedController('127.0.0.1', self.emulator.port, ackTimeout=0.02, retries=10)
+        try:
+            self.assertTrue(await controller.connect())
+            self.emulator.loss = 0.3
+            acks = []
+            for round in range(10):  # Каждый раунд ждёт подтверждений: старые команды не вытесняются
+                acks += await controller.sendAll([(id, 1, round, 0, 0) for id in range(6)])
+            self.assertEqual(len(acks), 60)
+            self.assertGreater(self.emulator.framesLost, 0)
+        finally:
+            await controller.disconnect()
+
+class TestEmulatorFleet(unittest.IsolatedAsyncioTestCase):
+    async def testScannerFindsFleetOnLoopbackAliases(self):
+        fleet = EmulatorFleet(50, aliases=True, udp=False)
+        await fleet.start()
+        try:
+            engine = AsyncScanEngine(port=fleet.emulators[0].port, concurrency=64)
+            results = await engine.scanAsync([host for host, _ in fleet.addresses])
+            self.assertEqual(sorted(r.deviceId for r in results), list(range(1, 51)))
+        finally:
+            await fleet.stop()
+
+    async def testDistinctPorts(self):
+        fleet = EmulatorFleet(3, firstId=0x10)
+        await fleet.start()
+        try:
+            self.assertEqual(len({port for _, port in fleet.addresses}), 3)
+        finally:
+            await fleet.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import time
+import types
+import unittest
+from controller_emulator import EmulatorFleet
+from controller_fleet import ControllerFleet
+from scheduler import Backoff
+
+class TestControllerFleet(unittest.TestCase):
+    def setUp(self):
+        self.emulators = EmulatorFleet(8, aliases=True, udp=False, firstId=0x40)
+        self.emulators.startInThread()
+        self.ips = [host for host, _ in self.emulators.addresses]
+        self.fleet = ControllerFleet(port=self.emulators.emulators[0].port,
+                                     backoff=Backoff(initial=0.05, maximum=0.2))
+        self.fleet.start()
+        self.assertEqual(self.fleet.addAll(self.ips).result(5), {ip: True for ip in self.ips})
+
+    def tearDown(self):
+        self.fleet.stop()
+        self.emulators.stopThread()
+
+    def testControllersAreKeyedByIpAndDeviceId(self):
+        self.assertEqual(self.fleet.deviceIds().result(2), {ip: 0x40 + i for i, ip in enumerate(self.ips)})
+        self.assertTrue(self.fleet.add(self.ips[0]).result(2))  # Повторное добавление не создаёт второй контроллер
+        self.assertEqual(len(self.fleet.controllers), 8)
+
+    def testBroadcastReachesEveryPort(self):
+        self.assertEqual(self.fleet.broadcast(1, 255, 255, 255, confirm=True).result(5),
+                         {ip: True for ip in self.ips})
+        for emulator in self.emulators.emulators:
+            self.assertEqual(emulator.ports, [(1, 255, 255, 255)] * 6)
+
+    def testGroupsAndDeviceIdTargets(self):
+        self.fleet.setGroup("north", [self.ips[0], 0x41])
+        self.fleet.setGroup("all-north", ["north", self.ips[2]]).result(2)
+        result = self.fleet.applyScene([(3, 2, 10, 20, 30)], "all-north", confirm=True).result(5)
+        self.assertEqual(result, {ip: True for ip in self.ips[:3]})
+        self.assertEqual([e.ports[3] for e in self.emulators.emulators[:4]], [(2, 10, 20, 30)] * 3 + [(0, 0, 0, 0)])
+        with self.assertRaises(KeyError):
+            self.fleet.applyScene([(0, 1, 0, 0, 0)], 0x7f).result(2)
+        with self.assertRaises(ValueError):
+            self.fleet.applyScene([(6, 1, 0, 0, 0)])
+
+    def testRemovedControllerIsDisconnected(self):
+        self.fleet.remove(self.ips[1]).result(2)
+        self.assertNotIn(self.ips[1], self.fleet.controllers)
+        deadline = time.monotonic() + 2
+        while self.emulators.emulators[1].clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.emulators.emulators[1].clients)
+
+    def testAttachedPadIsDrivenByItsOwner(self):
+        owner = RecordingOwner()
+        self.fleet.attach(self.ips[0], owner, 0x40).result(2)
+        deadline = time.monotonic() + 2
+        while self.emulators.emulators[0].clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.emulators.emulators[0].clients)  # Своё соединение парка закрыто
+        self.assertTrue(self.fleet.add(self.ips[0]).result(2))  # Повторное обнаружение не подключает парк
+        self.assertTrue(all(self.fleet.broadcast(1, 255, 255, 255, confirm=True).result(5).values()))
+        self.assertEqual(owner.commands, [[(id, 1, 255, 255, 255) for id in range(6)]])
+        self.assertEqual(self.emulators.emulators[0].commandsReceived, 0)
+        owner.led.connected = False  # Владелец в backoff: сцена не считается применённой
+        self.assertFalse(self.fleet.broadcast(1, 0, 0, 0, self.ips[0], confirm=True).result(5)[self.ips[0]])
+        self.assertFalse(self.fleet.applyScene([(0, 1, 0, 0, 0)], self.ips[0]).result(5)[self.ips[0]])
+        self.assertEqual(self.fleet.deviceIds().result(2)[self.ips[0]], 0x40)
+        self.fleet.detach(self.ips[0]).result(2)
+        self.assertTrue(self.fleet.add(self.ips[0]).result(2))
+
+class RecordingOwner:
+    def __init__(self):
+        self.commands = []
+        self.led = types.SimpleNamespace(connected=True)
+
+    def applyAll(self, commands):
+        self.commands.append(list(commands))
+
+if __name__ == '__main__':
+    unittest.main()
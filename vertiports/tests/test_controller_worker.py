@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from PyQt6.QtCore import QCoreApplication
+from controller_emulator import ControllerEmulator
+from controller_worker import ControllerWorker
+
+class TestControllerWorker(unittest.TestCase):
+    def setUp(self):
+        self.app = QCoreApplication.instance() or QCoreApplication([])
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.emulator = ControllerEmulator(port=0, deviceId=0x33, udp=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        self.worker = ControllerWorker()
+        self.statuses = []
+        self.worker.statusChanged.connect(self.statuses.append)
+        self.worker.start()
+
+    def tearDown(self):
+        self.worker.stop()
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def waitFor(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        return condition()
+
+    def testCommandsRunOnWorkerThread(self):
+        self.worker.connectTo('127.0.0.1', self.emulator.port)
+        self.worker.changeVertiport(2, 1, 10, 20, 30)
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[2] == (1, 10, 20, 30)))
+        self.assertTrue(self.waitFor(lambda: self.statuses[-1:] == ["connected"]))
+
+    def testBurstIsCoalescedToLatestCommand(self):
+        self.worker.connectTo('127.0.0.1', self.emulator.port)
+        self.assertTrue(self.waitFor(lambda: self.statuses[-1:] == ["connected"]))
+        for value in range(200):
+            self.worker.changeVertiport(0, 1, value, 0, 0)
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[0] == (1, 199, 0, 0)))
+        self.assertLess(self.emulator.commandsReceived, 20)
+
+    def testEncodedFramesReachSocketUnchanged(self):
+        self.worker.connectTo('127.0.0.1', self.emulator.port)
+        self.assertTrue(self.waitFor(lambda: self.statuses[-1:] == ["connected"]))
+        data = bytes([0x7e, 1, 1, 10, 20, 30, 0x7e, 4, 1, 40, 50, 60])
+        with mock.patch.object(self.worker.led, '_write', wraps=self.worker.led._write) as write:
+            self.worker.applyEncoded(data)
+            self.assertTrue(self.waitFor(lambda: self.emulator.ports[4] == (1, 40, 50, 60)))
+        write.assert_called_once_with(data)
+        with self.assertRaises(ValueError):
+            self.worker.applyEncoded(bytes([0x7e, 6, 1, 0, 0, 0]))
+        with self.assertRaises(ValueError):
+            self.worker.applyEncoded(bytes([0x7e, 1, 1]))
+
+    def testCommandsAndFramesCoalesceInPortOrder(self):
+        self.worker.connectTo('127.0.0.1', self.emulator.port)
+        self.assertTrue(self.waitFor(lambda: self.statuses[-1:] == ["connected"]))
+        with mock.patch.object(self.worker.led, '_write', wraps=self.worker.led._write) as write:
+            self.worker.lastFlush = time.monotonic() + 0.2  # Всё попадает в один сброс
+            self.worker.applyEncoded(bytes([0x7e, 5, 1, 1, 1, 1, 0x7e, 2, 1, 2, 2, 2]))
+            self.worker.applyAll([(0, 1, 3, 3, 3), (5, 1, 4, 4, 4)])
+            self.assertTrue(self.waitFor(lambda: self.emulator.ports[5] == (1, 4, 4, 4)))
+        write.assert_called_once_with(bytes([0x7e, 0, 1, 3, 3, 3, 0x7e, 2, 1, 2, 2, 2, 0x7e, 5, 1, 4, 4, 4]))
+
+    def testReportsEveryTransition(self):
+        self.worker.connectTo('127.0.0.1', self.emulator.port)
+        self.assertTrue(self.waitFor(lambda: self.statuses == ["connecting", "handshaking", "connected"]))
+
+    def testUnreachableControllerBacksOffAndRecovers(self):
+        port = self.emulator.port
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        self.worker.connectTo('127.0.0.1', port)
+        self.assertTrue(self.waitFor(lambda: any(s.startswith("backoff:") for s in self.statuses)))
+        self.emulator = ControllerEmulator(port=port, deviceId=0x33, udp=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        self.assertTrue(self.waitFor(lambda: self.statuses[-1:] == ["connected"], timeout=5.0))
+
+if __name__ == '__main__':
+    unittest.main()
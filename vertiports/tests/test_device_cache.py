@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+import unittest
+from device_cache import DeviceCache
+
+class TestDeviceCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpDir.name, 'devices.json')
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def testSaveAndLoadRoundTrip(self):
+        cache = DeviceCache(self.path)
+        cache.update("192.168.1.10", 0x17, 0.002)
+        cache.save()
+        restored = DeviceCache(self.path)
+        self.assertEqual(restored.addresses(), ["192.168.1.10"])
+        self.assertEqual(restored.entries["192.168.1.10"]["deviceId"], 0x17)
+
+    def testMostRecentFirstAndExpiredDropped(self):
+        cache = DeviceCache(self.path, ttl=60)
+        cache.update("10.0.0.2", 1, 0.001)
+        cache.update("10.0.0.3", 2, 0.001)
+        cache.entries["10.0.0.2"]["lastSeen"] = time.time() - 10
+        cache.entries["10.0.0.4"] = {"ip": "10.0.0.4", "deviceId": 3, "lastSeen": time.time() - 120, "rtt": 0.001}
+        self.assertEqual(cache.addresses(), ["10.0.0.3", "10.0.0.2"])
+
+    def testDemotedAddressIsProbedLastUntilItAnswers(self):
+        cache = DeviceCache(self.path)
+        cache.update("10.0.0.2", 1, 0.001)
+        cache.update("10.0.0.3", 2, 0.001)
+        cache.demote("10.0.0.3")
+        self.assertEqual(cache.addresses(), ["10.0.0.2", "10.0.0.3"])
+        time.sleep(0.01)
+        cache.update("10.0.0.3", 2, 0.001)
+        self.assertEqual(cache.addresses(), ["10.0.0.3", "10.0.0.2"])
+
+    def testCorruptFileIsIgnored(self):
+        with open(self.path, 'w') as f:
+            f.write("{not json")
+        self.assertEqual(DeviceCache(self.path).addresses(), [])
+
+if __name__ == '__main__':
+    unittest.main()
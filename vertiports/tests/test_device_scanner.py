@@ -1,12 +1,123 @@
+import ipaddress
+import os
+import tempfile
+import threading
+import time
 import unittest
+from PyQt6.QtCore import QCoreApplication
+from benchmark import LoopbackScanner
+from controller_emulator import EmulatorFleet
+from device_cache import DeviceCache
 from device_scanner import DeviceScanner
 
 class TestDeviceScanner(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cache = DeviceCache(os.path.join(self.tmpDir.name, 'devices.json'))
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
     def testGetLocalIp(self):
-        scanner = DeviceScanner()
+        scanner = DeviceScanner(cache=self.cache)
         ip = scanner._getLocalIp()  # Используем приватный метод для тестирования
         self.assertIsNotNone(ip)
         self.assertNotEqual(ip, "")
 
+    def testBuildTargetsUsesRealPrefixAndDeduplicates(self):
+        scanner = DeviceScanner(cache=self.cache)
+        networks = [
+            ("eth0", ipaddress.IPv4Interface("10.0.0.5/23")),
+            ("eth1", ipaddress.IPv4Interface("10.0.1.7/24")),
+        ]
+        targets = scanner._buildTargets(networks)
+        self.assertEqual(len(targets), 510 - 2)  # /23 без своих адресов, /24 внутри него
+        self.assertEqual(len(set(targets)), len(targets))
+        self.assertNotIn("10.0.0.5", targets)
+        self.assertEqual(targets[:2], ["10.0.0.1", "10.0.1.1"])  # Интерфейсы чередуются
+
+    def testBuildTargetsClipsLargeNetworks(self):
+        scanner = DeviceScanner(maxPrefix=22, cache=self.cache)
+        targets = scanner._buildTargets([("eth0", ipaddress.IPv4Interface("172.16.5.10/16"))])
+        self.assertEqual(len(targets), 1022 - 1)
+        self.assertTrue(all(t.startswith("172.16.") for t in targets))
+
+    def testOrderTargetsPutsControllerOuiFirst(self):
+        scanner = DeviceScanner(cache=self.cache)
+        neighbors = {"10.0.0.9": "3c:52:82:00:00:01", "10.0.0.7": "00:80:e1:12:34:56"}
+        hosts = ["10.0.0.1", "10.0.0.7", "10.0.0.8", "10.0.0.9"]
+        self.assertEqual(scanner._orderTargets(hosts, neighbors), ["10.0.0.7", "10.0.0.9", "10.0.0.1", "10.0.0.8"])
+
+class TestScanNetwork(unittest.TestCase):
+    NETWORK = "127.255.255.248/29"  # Узлы .249-.254, широковещательный адрес loopback 127.255.255.255
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cache = DeviceCache(os.path.join(self.tmpDir.name, 'devices.json'))
+        self.emulators = EmulatorFleet(2, aliases=True, udp=False, firstAlias='127.255.255.250')
+        self.emulators.startInThread()
+        self.port = self.emulators.emulators[0].port
+        self.found = []
+        self.completed = []
+
+    def tearDown(self):
+        self.emulators.stopThread()
+        self.tmpDir.cleanup()
+
+    def scanner(self, scannerClass=LoopbackScanner, **kwargs):
+        scanner = scannerClass(self.NETWORK, port=self.port, cache=self.cache, **kwargs)
+        scanner.deviceFound.connect(self.found.append)
+        scanner.scanCompleted.connect(self.completed.append)
+        return scanner
+
+    def testCachedAddressesAreProbedFirst(self):
+        self.cache.update('127.255.255.251', 0x02, 0.001)
+        self.scanner(udpDiscovery=False).scanNetwork()
+        self.assertEqual(self.found, ['127.255.255.251', '127.255.255.250'])
+        self.assertEqual(self.completed, [True])
+        self.assertEqual(DeviceCache(self.cache.path).entries['127.255.255.250']['deviceId'], 0x01)
+
+    def testUdpAnswerSkipsTcpSweep(self):
+        responder = EmulatorFleet(1, aliases=True, port=self.port, firstAlias='127.255.255.249', firstId=0x07)
+        responder.startInThread()
+        try:
+            self.scanner().scanNetwork()
+        finally:
+            responder.stopThread()
+        self.assertEqual(self.found, ['127.255.255.249'])  # Ответ на широковещательный запрос; .250 и .251 не опрашивались
+        self.assertEqual(self.completed, [True])
+
+    def testSilenceFallsBackToTcpSweep(self):
+        self.scanner().scanNetwork()
+        self.assertEqual(sorted(self.found), ['127.255.255.250', '127.255.255.251'])
+        self.assertEqual(self.completed, [True])
+
+    def testStartScanCancelsPreviousSession(self):
+        scanner = self.scanner(GatedScanner, udpDiscovery=False)
+        scanner.startScan()
+        first = scanner.session
+        scanner.startScan()
+        self.assertTrue(first.cancelled)
+        scanner.gate.set()
+        app = QCoreApplication.instance() or QCoreApplication([])  # Сигналы из потоков сканера идут через очередь
+        deadline = time.monotonic() + 5
+        while not self.completed and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.01)
+        time.sleep(0.2)  # Отменённый сеанс успел бы сообщить о завершении
+        app.processEvents()
+        self.assertEqual(self.completed, [True])
+        self.assertEqual(sorted(self.found), ['127.255.255.250', '127.255.255.251'])
+
+class GatedScanner(LoopbackScanner):
+    """Сканер, сеансы которого ждут gate перед обходом: отмена успевает прийти во время работы."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = threading.Event()
+
+    def _getNeighbors(self):
+        self.gate.wait(5)
+        return {}
+
 if __name__ == '__main__':
     unittest.main()
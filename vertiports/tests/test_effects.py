@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+from effects import Blink, CurveEffect, Effect, EffectEngine, Fade, Rainbow, Static, Wave, createEffect, easeInOut, numpy
+from protocol import vertiportCommands, vertiportFrame
+
+class RecordingTarget:
+    def __init__(self):
+        self.frames = []
+        self.lock = threading.Lock()
+
+    def applyAll(self, commands):
+        with self.lock:
+            self.frames.append((time.monotonic(), list(commands)))
+
+    def applyEncoded(self, data):
+        self.applyAll(vertiportCommands(data))
+
+class TestEffects(unittest.TestCase):
+    def testBlinkFollowsDutyCycle(self):
+        blink = Blink((10, 20, 30), period=1.0, duty=0.25)
+        self.assertEqual(blink.color(0, 0.1), (10, 20, 30))
+        self.assertEqual(blink.color(0, 0.5), (0, 0, 0))
+
+    def testWaveIsPhaseShiftedAcrossPorts(self):
+        wave = Wave((200, 0, 0), period=6.0, spread=1 / 6)
+        self.assertEqual(wave.color(0, 0), (0, 0, 0))
+        self.assertEqual(wave.color(1, 1.0), (0, 0, 0))  # Порт 1 повторяет порт 0 через 1/6 периода
+        self.assertEqual(wave.color(0, 3.0), (200, 0, 0))
+
+    def testRainbowAndFade(self):
+        self.assertEqual(Rainbow().color(0, 0), (255, 0, 0))
+        fade = Fade((0, 0, 0), (100, 200, 0), duration=2.0, curve=easeInOut)
+        self.assertEqual(fade.color(0, 1.0), (50, 100, 0))
+        self.assertEqual(fade.color(0, 5.0), (100, 200, 0))
+
+    def testCurveIsClamped(self):
+        effect = CurveEffect((100, 100, 100), lambda x: 2 * x - 0.5)
+        self.assertEqual(effect.color(0, 0.0), (0, 0, 0))
+        self.assertEqual(effect.color(0, 0.9), (100, 100, 100))
+
+    def testUnknownEffectName(self):
+        with self.assertRaises(ValueError):
+            createEffect("strobe", (0, 0, 0))
+
+    def testFadeAndPulseByName(self):
+        self.assertEqual(createEffect("fade", (100, 200, 0)).color(0, 1.0), (100, 200, 0))
+        pulse = createEffect("pulse", (100, 100, 100))
+        self.assertEqual([pulse.color(0, t) for t in (0.0, 0.5)], [(0, 0, 0), (100, 100, 100)])
+
+    def testEffectRequiresColor(self):
+        with self.assertRaises(TypeError):
+            Effect()
+
+class TestEffectEngine(unittest.TestCase):
+    def testFramesArePacedAtFixedRate(self):
+        targets = [RecordingTarget(), RecordingTarget()]
+        engine = EffectEngine(fps=50)
+        for target in targets:
+            engine.setEffect(target, range(6), Static((1, 2, 3)))
+        engine.start()
+        time.sleep(0.5)
+        engine.stop()
+        for target in targets:
+            self.assertGreaterEqual(len(target.frames), 20)
+            self.assertLessEqual(len(target.frames), 27)
+            self.assertEqual(target.frames[-1][1], [(port, 1, 1, 2, 3) for port in range(6)])
+        intervals = [b[0] - a[0] for a, b in zip(targets[0].frames, targets[0].frames[1:])]
+        self.assertAlmostEqual(sum(intervals) / len(intervals), 0.02, delta=0.005)
+
+    def testClearStopsPortUpdates(self):
+        target = RecordingTarget()
+        engine = EffectEngine(fps=100)
+        engine.setEffect(target, [0, 1], Static((5, 5, 5)))
+        engine.clearEffect(target, 1)
+        self.assertEqual(engine.renderFrame(time.monotonic()), {target: [(0, 1, 5, 5, 5)]})
+        engine.clearEffect(target)
+        self.assertEqual(engine.renderFrame(time.monotonic()), {})
+
+    def testGammaAndBrightnessTable(self):
+        target = RecordingTarget()
+        engine = EffectEngine(gamma=2.0, brightness=0.5)
+        engine.setEffect(target, 0, Static((255, 128, 0)))
+        self.assertEqual(engine.renderFrame(time.monotonic()), {target: [(0, 1, 128, 32, 0)]})
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestVectorizedFrames(unittest.TestCase):
+    def testVectorizedColorsMatchScalar(self):
+        ports = numpy.arange(6)
+        for effect in (Static((1, 2, 3)), Blink((9, 8, 7), period=0.7), Wave((200, 100, 50)), Rainbow(period=3.0),
+                       Fade((0, 50, 255), (255, 0, 0), duration=2.0, curve=easeInOut),
+                       CurveEffect((90, 0, 90), lambda x: x)):
+            for t in (0.0, 0.3, 1.1, 2.9):
+                expected = [effect.color(port, t) for port in range(6)]
+                vectorized = numpy.rint(effect.colors(ports, numpy.full(6, t))).astype(int).tolist()
+                for want, got in zip(expected, vectorized):
+                    for a, b in zip(want, got):
+                        self.assertLessEqual(abs(a - b), 1, f"{type(effect).__name__} at {t}")
+
+    def testFrameIsEncodedFromBuffer(self):
+        first, second = RecordingTarget(), RecordingTarget()
+        engine = EffectEngine(gamma=2.0, brightness=0.5)
+        wave = Wave((255, 0, 0), period=6.0)
+        engine.setEffect(first, [4, 1], wave)
+        engine.setEffect(second, range(6), wave)
+        engine.setEffect(second, 2, Static((255, 128, 0)))
+        now = time.monotonic() + 3.0
+        targets, colors, active = engine.renderBuffer(now)
+        self.assertEqual(colors.shape, (2, 6, 3))
+        self.assertEqual(active.sum(), 8)
+        encoded = engine.encodeFrame(now)
+        for target, commands in engine.renderFrame(now).items():
+            self.assertEqual(encoded[target], b''.join(vertiportFrame(*command) for command in commands))
+        self.assertEqual(vertiportCommands(encoded[second])[2], (2, 1, 128, 32, 0))
+
+if __name__ == '__main__':
+    unittest.main()
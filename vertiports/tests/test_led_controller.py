@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from controller_emulator import ControllerEmulator
+from led_controller import STMLedController
+from scheduler import Backoff, Scheduler
+
+class TestSTMLedController(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.emulator = ControllerEmulator(port=0, deviceId=0x11, udp=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        self.controller = STMLedController('127.0.0.1', self.emulator.port, autoReconnect=False)
+
+    def tearDown(self):
+        self.controller.disconnect()
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def waitFor(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def testConnectIdentifiesDevice(self):
+        self.assertTrue(self.controller.connected)
+        self.assertEqual(self.controller.deviceId, 0x11)
+
+    def testApplyAllIsOneWrite(self):
+        scene = [(id, 1, 255, 255, 255) for id in range(6)]
+        with mock.patch.object(self.controller, '_write', wraps=self.controller._write) as write:
+            self.assertTrue(self.controller.applyAll(scene))
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(len(write.call_args[0][0]), 6 * 6)
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports == [(1, 255, 255, 255)] * 6))
+
+    def testApplyEncodedSendsFramesAsIs(self):
+        data = bytes([0x7e, 2, 1, 10, 20, 30, 0x7e, 5, 1, 40, 50, 60])
+        with mock.patch.object(self.controller, '_write', wraps=self.controller._write) as write:
+            self.assertTrue(self.controller.applyEncoded(data))
+        write.assert_called_once_with(data)
+        self.assertEqual(self.controller.configuredPorts, {2, 5})
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[5] == (1, 40, 50, 60)))
+        self.assertTrue(self.waitFor(lambda: self.controller.pollResponses() == 0))
+
+    def testInvalidCommandIsRejectedBeforeStaging(self):
+        with self.assertRaises(ValueError):
+            self.controller.applyAll([(0, 1, 1, 1, 1), (6, 1, 0, 0, 0)])
+        with self.assertRaises(ValueError):
+            self.controller.changeVertiport(1, 1, 256, 0, 0)
+        self.assertEqual(self.controller.configuredPorts, {0})
+        self.assertEqual(self.controller.vertiportsCommand[1].r, 0)
+
+    def testSendWaitsForReconnectInProgress(self):
+        done = threading.Event()
+        with self.controller.lock:  # Так держит блокировку переподключение в потоке планировщика
+            threading.Thread(target=lambda: (self.controller.changeVertiport(0, 1, 1, 1, 1), done.set()),
+                             daemon=True).start()
+            self.assertFalse(done.wait(0.1))
+        self.assertTrue(done.wait(2))
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[0] == (1, 1, 1, 1)))
+
+    def testStagedChangesWaitForCommit(self):
+        self.controller.stageVertiport(3, 2, 1, 2, 3)
+        time.sleep(0.05)
+        self.assertEqual(self.emulator.commandsReceived, 0)
+        self.controller.commit()
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[3] == (2, 1, 2, 3)))
+
+    def testReconnectRestoresWholeTable(self):
+        self.controller.applyAll([(0, 1, 10, 0, 0), (2, 2, 0, 20, 0), (4, 3, 0, 0, 30)])
+        self.assertTrue(self.waitFor(lambda: self.emulator.commandsReceived == 3))
+        self.emulator.ports = [(0, 0, 0, 0)] * 6  # Контроллер потерял состояние при обрыве
+        self.controller.communicator.close()
+        self.controller.communicator = None
+        self.controller.reconnect()
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[4] == (3, 0, 0, 30)))
+        self.assertEqual(self.emulator.ports[0], (1, 10, 0, 0))
+        self.assertEqual(self.emulator.ports[2], (2, 0, 20, 0))
+
+    def testDifferentDeviceIsNotRestored(self):
+        self.controller.applyAll([(0, 1, 10, 0, 0)])
+        self.assertTrue(self.waitFor(lambda: self.controller.pollResponses() == 0))
+        port = self.emulator.port
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        self.emulator = ControllerEmulator(port=port, deviceId=0x22, udp=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        self.controller.communicator.close()
+        self.controller.communicator = None
+        self.controller.reconnect()
+        self.assertFalse(self.controller.connected)
+        self.assertEqual(self.controller.deviceId, 0x11)
+        self.assertEqual(self.emulator.commandsReceived, 0)
+
+    def testBackoffReconnectsAfterControllerRestart(self):
+        port = self.emulator.port
+        states = []
+        scheduler = Scheduler()
+        scheduler.start()
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        controller = STMLedController('127.0.0.1', port, scheduler=scheduler,
+                                      backoff=Backoff(initial=0.05, maximum=0.2),
+                                      onStateChanged=lambda c: states.append(c.state))
+        self.assertEqual(states[:2], [STMLedController.CONNECTING, STMLedController.BACKOFF])
+        controller.stageVertiport(1, 1, 5, 5, 5)
+        self.emulator = ControllerEmulator(port=port, deviceId=0x11, udp=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        self.assertTrue(self.waitFor(lambda: controller.connected))
+        self.assertTrue(self.waitFor(lambda: self.emulator.ports[1] == (1, 5, 5, 5)))
+        self.assertEqual(states[-2:], [STMLedController.HANDSHAKING, STMLedController.CONNECTED])
+        controller.disconnect()
+        scheduler.stop()
+        self.assertEqual(controller.state, STMLedController.DISCONNECTED)
+
+    def testReconnectsToFirmwareWithoutAcks(self):
+        port = self.emulator.port
+        self.controller.disconnect()
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        self.emulator = ControllerEmulator(port=port, deviceId=0x11, udp=False, acks=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        scheduler = Scheduler()
+        scheduler.start()
+        self.controller = STMLedController('127.0.0.1', port, scheduler=scheduler,
+                                           backoff=Backoff(initial=0.05, maximum=0.2))
+        self.assertTrue(self.controller.connected)
+        self.controller.changeVertiport(2, 1, 3, 4, 5)
+        asyncio.run_coroutine_threadsafe(self.emulator.stop(), self.loop).result()
+        self.emulator = ControllerEmulator(port=port, deviceId=0x11, udp=False, acks=False)
+        asyncio.run_coroutine_threadsafe(self.emulator.start(), self.loop).result()
+        self.controller.changeVertiport(3, 1, 0, 0, 0)  # Обрыв обнаруживается на записи
+        self.assertTrue(self.waitFor(lambda: self.controller.connected))
+        self.assertEqual(self.emulator.ports[2], (1, 3, 4, 5))
+        self.assertFalse(self.controller.acksSeen)
+        self.controller.disconnect()
+        scheduler.stop()
+
+    def testLegacyWhoIAmReplyIsAccepted(self):
+        for deviceId in (0x07, 0x06, 0x15):
+            emulator = ControllerEmulator(port=0, deviceId=deviceId, udp=False, framedWhoIAm=False)
+            asyncio.run_coroutine_threadsafe(emulator.start(), self.loop).result()
+            controller = STMLedController('127.0.0.1', emulator.port, autoReconnect=False)
+            self.assertTrue(controller.connected)
+            self.assertEqual(controller.deviceId, deviceId)
+            controller.changeVertiport(1, 1, 2, 3, 4)
+            self.assertTrue(self.waitFor(lambda: controller.pollResponses() == 0))
+            controller.disconnect()
+            asyncio.run_coroutine_threadsafe(emulator.stop(), self.loop).result()
+
+    def testAcksAreCollectedWithoutBlockingReads(self):
+        self.controller.applyAll([(id, 1, 1, 1, 1) for id in range(6)])
+        self.assertTrue(self.waitFor(lambda: self.controller.pollResponses() == 0))
+        self.assertEqual(self.controller.rejectedCommands, 0)
+
+    def testUnchangedPortsAreNotResent(self):
+        self.controller.applyAll([(id, 1, 100, 0, 0) for id in range(6)])
+        self.assertTrue(self.waitFor(lambda: self.controller.pollResponses() == 0))
+        self.controller.delta.minColorDelta = 3
+        with mock.patch.object(self.controller, '_write', wraps=self.controller._write) as write:
+            self.controller.applyAll([(id, 1, 102, 0, 0) for id in range(5)] + [(5, 1, 90, 0, 0)])
+        write.assert_called_once_with(bytes([0x7e, 5, 1, 90, 0, 0]))
+        self.assertTrue(self.waitFor(lambda: self.emulator.commandsReceived == 7))
+        self.assertEqual(self.controller.delta.skipped, 5)
+
+    def testLateAcksDoNotConfuseWhoIAm(self):
+        self.controller.applyAll([(id, 2, 0, 0, 0) for id in range(6)])
+        self.assertEqual(self.controller._whoIAm(), 0x11)  # Подтверждения пришли раньше ответа на WhoIAm
+
+if __name__ == '__main__':
+    unittest.main()
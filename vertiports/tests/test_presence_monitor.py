@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from device_cache import DeviceCache
+from presence_monitor import PresenceMonitor
+from scan_engine import ProbeResult
+
+class TestPresenceMonitor(unittest.TestCase):
+    def setUp(self):
+        self.changes = []
+        self.monitor = PresenceMonitor(failureThreshold=2, latencyChange=0.5,
+                                       onChange=lambda ip, state, rtt: self.changes.append((ip, state)))
+        self.target = PresenceMonitor.Target("10.0.0.5")
+
+    def testUpPublishedOnceWhileStable(self):
+        for _ in range(3):
+            self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.010))
+        self.assertEqual(self.changes, [("10.0.0.5", PresenceMonitor.UP)])
+
+    def testDownNeedsConsecutiveFailures(self):
+        self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.010))
+        self.monitor._update(self.target, None)
+        self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.010))
+        self.monitor._update(self.target, None)
+        self.assertEqual(len(self.changes), 1)
+        self.monitor._update(self.target, None)
+        self.assertEqual(self.changes[-1], ("10.0.0.5", PresenceMonitor.DOWN))
+
+    def testLatencyJumpIsPublished(self):
+        self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.010))
+        self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.011))
+        self.assertEqual(len(self.changes), 1)
+        self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.100))
+        self.assertEqual(len(self.changes), 2)
+        self.assertEqual(self.changes[-1], ("10.0.0.5", PresenceMonitor.UP))
+
+    def testProbesRefreshCache(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, 'devices.json')
+            self.monitor.cache = DeviceCache(path)
+            self.monitor.cache.update("10.0.0.9", 2, 0.001)
+            self.monitor._update(self.target, ProbeResult("10.0.0.5", 1, 0.010))
+            self.assertEqual(DeviceCache(path).addresses(), ["10.0.0.5", "10.0.0.9"])
+            self.monitor._update(self.target, None)
+            self.monitor._update(self.target, None)
+            self.assertEqual(DeviceCache(path).addresses(), ["10.0.0.9", "10.0.0.5"])
+
+if __name__ == '__main__':
+    unittest.main()
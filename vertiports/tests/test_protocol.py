@@ -0,0 +1,122 @@
+import unittest
+from protocol import (Ack, CommandEncoder, DeltaFilter, Error, FrameDecoder, ResponseMatcher, WhoIAmReply,
+                      WHO_I_AM_KEY, commandKey, vertiportCommands, vertiportFrame, whoIAmDeviceId)
+
+class TestFrameDecoder(unittest.TestCase):
+    def testSplitsCoalescedFrames(self):
+        decoder = FrameDecoder()
+        decoder.feed(bytes([0x06, 2, 1, 9, 8, 7, 0x42, 0x11, 0x15, 7, 1, 0, 0, 0, 1]))
+        self.assertEqual(list(decoder.frames()), [Ack(2, 1, 9, 8, 7), WhoIAmReply(0x11), Error(7, 1, 0, 0, 0, 1)])
+
+    def testKeepsPartialFrameUntilNextRead(self):
+        decoder = FrameDecoder()
+        decoder.feed(bytes([0x15, 3, 1, 2]))
+        self.assertEqual(list(decoder.frames()), [])
+        decoder.feed(bytes([3, 4, 1]))
+        self.assertEqual(list(decoder.frames()), [Error(3, 1, 2, 3, 4, 1)])
+
+    def testSkipsUnknownBytes(self):
+        decoder = FrameDecoder()
+        decoder.feed(bytes([0xff, 0x00, 0x42, 1]))
+        self.assertEqual(list(decoder.frames()), [WhoIAmReply(1)])
+
+    def testLegacyWhoIAmByteWhileWaitingForWhoIAm(self):
+        decoder = FrameDecoder()
+        decoder.feed(bytes([0x07]))
+        self.assertEqual(list(decoder.frames(lambda: (True, False))), [WhoIAmReply(0x07)])
+        decoder.feed(bytes([0x06]))
+        self.assertEqual(list(decoder.frames(lambda: (True, False))), [WhoIAmReply(0x06)])
+        decoder.feed(bytes([0x06, 1, 1, 0, 0, 0]))
+        self.assertEqual(list(decoder.frames(lambda: (True, True))), [Ack(1, 1, 0, 0, 0)])
+        decoder.feed(bytes([0x07]))
+        self.assertEqual(list(decoder.frames(lambda: (False, True))), [])
+
+    def testRecvIntoWritableAndGrowth(self):
+        decoder = FrameDecoder(size=4)
+        decoder.feed(bytes([0x06, 1]))
+        target = decoder.writable(room=8)
+        target[:8] = bytes([0, 0, 0, 0, 0x06, 2, 0, 0])
+        decoder.advance(8)
+        self.assertEqual(list(decoder.frames()), [Ack(1, 0, 0, 0, 0)])
+        decoder.feed(bytes([0, 0]))
+        self.assertEqual(list(decoder.frames()), [Ack(2, 0, 0, 0, 0)])
+
+class TestCommandEncoder(unittest.TestCase):
+    def testPacksIntoReusedBuffer(self):
+        encoder = CommandEncoder(capacity=2)
+        buffer = encoder.buffer
+        commands = [(0, 1, 2, 3, 4), (5, 1, 255, 0, 9)]
+        self.assertEqual(bytes(encoder.encode(commands)), b''.join(vertiportFrame(*c) for c in commands))
+        self.assertEqual(vertiportCommands(encoder.view()), commands)
+        encoder.encode(commands[:1])
+        self.assertIs(encoder.buffer, buffer)
+        self.assertEqual(len(encoder), 1)
+        self.assertEqual(len(encoder.encode(commands * 3)), 36)  # Буфер вырос
+
+    def testValidatesRanges(self):
+        encoder = CommandEncoder()
+        for command in [(6, 1, 0, 0, 0), (-1, 1, 0, 0, 0), (0, 256, 0, 0, 0), (0, 1, 0, -1, 0)]:
+            with self.assertRaises(ValueError):
+                encoder.pack(*command)
+        self.assertEqual(len(encoder), 0)
+        with self.assertRaises(ValueError):
+            vertiportFrame(0, 1, 300, 0, 0)
+
+class TestResponseMatcher(unittest.TestCase):
+    def testMatchesInOrderAndDropsUnsolicited(self):
+        matcher = ResponseMatcher()
+        first = matcher.expect(commandKey(1, 1, 0, 0, 0))
+        second = matcher.expect(commandKey(1, 1, 0, 0, 0))
+        other = matcher.expect(commandKey(1, 2, 0, 0, 0))
+        self.assertIs(matcher.match(Ack(1, 2, 0, 0, 0)), other)
+        self.assertIs(matcher.match(Ack(1, 1, 0, 0, 0)), first)
+        self.assertIs(matcher.match(Error(1, 1, 0, 0, 0, 1)), second)
+        self.assertIsNone(matcher.match(Ack(1, 1, 0, 0, 0)))
+
+    def testDiscardUsesIdentity(self):
+        matcher = ResponseMatcher()
+        first, second = [], []
+        matcher.expect(WHO_I_AM_KEY, first)
+        matcher.expect(WHO_I_AM_KEY, second)
+        matcher.discard(WHO_I_AM_KEY, second)
+        self.assertIs(matcher.match(WhoIAmReply(5)), first)
+        self.assertEqual(matcher.outstanding(), 0)
+
+    def testLimitEvictsOldest(self):
+        matcher = ResponseMatcher(limit=2)
+        oldest = matcher.expect(commandKey(0, 1, 0, 0, 0))
+        for value in range(4):
+            matcher.expect(commandKey(0, 1, value + 1, 0, 0))
+        self.assertEqual(matcher.outstanding(), 2)
+        self.assertIsNone(matcher.match(Ack(0, 1, 0, 0, 0)))
+        self.assertIsNot(matcher.match(Ack(0, 1, 4, 0, 0)), oldest)
+
+class TestDeltaFilter(unittest.TestCase):
+    def testSkipsOnlyAcknowledgedState(self):
+        delta = DeltaFilter(minColorDelta=4)
+        self.assertFalse(delta.unchanged(1, 1, 10, 10, 10))
+        delta.markSent(1, 1, 10, 10, 10)
+        self.assertFalse(delta.unchanged(1, 1, 10, 10, 10))  # Ещё не подтверждено
+        delta.markAcked(Ack(1, 1, 10, 10, 10))
+        self.assertTrue(delta.unchanged(1, 1, 13, 7, 10))
+        self.assertFalse(delta.unchanged(1, 1, 14, 10, 10))
+        self.assertFalse(delta.unchanged(1, 2, 10, 10, 10))
+        self.assertEqual(delta.skipped, 1)
+        delta.reset()
+        self.assertFalse(delta.unchanged(1, 1, 10, 10, 10))
+
+    def testStaleAckDoesNotConfirmNewerCommand(self):
+        delta = DeltaFilter()
+        delta.markSent(0, 1, 1, 1, 1)
+        delta.markSent(0, 1, 2, 2, 2)
+        delta.markAcked(Ack(0, 1, 1, 1, 1))
+        self.assertFalse(delta.unchanged(0, 1, 1, 1, 1))
+        self.assertFalse(delta.unchanged(0, 1, 2, 2, 2))
+
+class TestWhoIAmDeviceId(unittest.TestCase):
+    def testFramedAndLegacyReplies(self):
+        self.assertEqual(whoIAmDeviceId(bytes([0x42, 0x17])), 0x17)
+        self.assertEqual(whoIAmDeviceId(bytes([0x17])), 0x17)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from rtt_estimator import RttEstimator
+
+class TestRttEstimator(unittest.TestCase):
+    def testDefaultWithoutSamples(self):
+        estimator = RttEstimator(ceiling=2.0)
+        self.assertEqual(estimator.timeout(0.3), 0.3)
+        self.assertEqual(estimator.timeout(), 2.0)
+
+    def testTimeoutFollowsPercentileWithinBounds(self):
+        estimator = RttEstimator(percentile=0.9, multiplier=4.0, floor=0.05, ceiling=1.0)
+        for _ in range(9):
+            estimator.addSample(0.001)
+        self.assertEqual(estimator.timeout(), 0.05)  # Быстрая сеть упирается в floor
+        for _ in range(10):
+            estimator.addSample(0.1)
+        self.assertAlmostEqual(estimator.timeout(), 0.4)
+        estimator.addSample(5.0)
+        for _ in range(20):
+            estimator.addSample(0.5)
+        self.assertEqual(estimator.timeout(), 1.0)  # Медленная сеть упирается в ceiling
+
+    def testWindowForgetsOldSamples(self):
+        estimator = RttEstimator(window=4, multiplier=1.0, floor=0.0)
+        for rtt in (0.9, 0.9, 0.9, 0.9, 0.1, 0.1, 0.1, 0.1):
+            estimator.addSample(rtt)
+        self.assertAlmostEqual(estimator.estimate(), 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
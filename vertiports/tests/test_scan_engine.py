@@ -0,0 +1,124 @@
+import asyncio
+import socket
+import socketserver
+import threading
+import unittest
+from scan_engine import AsyncScanEngine, SelectorScanEngine, ScanSession, UdpDiscovery, WHO_I_AM_REQUEST
+from controller_emulator import ControllerEmulator
+
+class TestAsyncScanEngine(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        async def handle(reader, writer):
+            if await reader.read(len(WHO_I_AM_REQUEST)) == WHO_I_AM_REQUEST:
+                writer.write(bytes([0x17]))
+                await writer.drain()
+            writer.close()
+
+        self.server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def testScanFindsDevice(self):
+        engine = AsyncScanEngine(port=self.port, concurrency=4)
+        found = []
+        results = await engine.scanAsync(['127.0.0.1'], onFound=found.append)
+        self.assertEqual([r.ip for r in results], ['127.0.0.1'])
+        self.assertEqual(found[0].deviceId, 0x17)
+
+    async def testClosedPortIsSkipped(self):
+        self.server.close()
+        await self.server.wait_closed()
+        engine = AsyncScanEngine(port=self.port, concurrency=4)
+        self.assertEqual(await engine.scanAsync(['127.0.0.1']), [])
+
+    async def testSilentPeerFailsHandshake(self):
+        async def silent(reader, writer):
+            await reader.read(1024)
+
+        server = await asyncio.start_server(silent, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        engine = AsyncScanEngine(port=port, concurrency=4, handshakeTimeout=0.05)
+        try:
+            self.assertEqual(await engine.scanAsync(['127.0.0.1']), [])
+        finally:
+            server.close()
+
+    async def testStopOnFirstDevice(self):
+        engine = AsyncScanEngine(port=self.port, concurrency=1)
+        session = ScanSession(total=10, stopOnFirst=True)
+        results = await engine.scanAsync(['127.0.0.1'] * 10, session=session)
+        self.assertEqual(len(results), 1)
+        self.assertFalse(session.cancelled)
+
+class WhoIAmHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        if self.request.recv(1024) == WHO_I_AM_REQUEST:
+            self.request.sendall(bytes([0x17]))
+
+class TestSelectorScanEngine(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), WhoIAmHandler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testScanFindsDevice(self):
+        engine = SelectorScanEngine(port=self.port, concurrency=4)
+        results = engine.scan(['127.0.0.1'])
+        self.assertEqual([(r.ip, r.deviceId) for r in results], [('127.0.0.1', 0x17)])
+
+    def testConcurrencyBoundsOpenSockets(self):
+        engine = SelectorScanEngine(port=self.port, concurrency=2)
+        results = engine.scan(['127.0.0.1'] * 5)
+        self.assertEqual(len(results), 5)
+
+    def testClosedPortIsSkipped(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            closedPort = s.getsockname()[1]
+        engine = SelectorScanEngine(port=closedPort, concurrency=4)
+        self.assertEqual(engine.scan(['127.0.0.1']), [])
+
+    def testProgressIsReported(self):
+        progress = []
+        session = ScanSession(total=3, onProgress=lambda done, total: progress.append((done, total)))
+        SelectorScanEngine(port=self.port, concurrency=1).scan(['127.0.0.1'] * 3, session=session)
+        self.assertEqual(progress[-1], (3, 3))
+
+    def testCancelledSessionStopsScan(self):
+        session = ScanSession()
+        session.cancel()
+        engine = SelectorScanEngine(port=self.port, concurrency=4)
+        self.assertEqual(engine.scan(['127.0.0.1'] * 3, session=session), [])
+
+class TestUdpDiscovery(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.emulator = ControllerEmulator(port=0, deviceId=0x2a)
+        await self.emulator.start()
+
+    async def asyncTearDown(self):
+        await self.emulator.stop()
+
+    async def testEmulatorAnswersDatagram(self):
+        discovery = UdpDiscovery(port=self.emulator.port, window=0.2)
+        results = await asyncio.to_thread(discovery.discover, ['127.0.0.1'])
+        self.assertEqual([(r.ip, r.deviceId) for r in results], [('127.0.0.1', 0x2a)])
+
+    async def testEmulatorAnswersSubnetBroadcast(self):
+        discovery = UdpDiscovery(port=self.emulator.port, window=0.2)
+        results = await asyncio.to_thread(discovery.discover, ['127.255.255.255'])
+        self.assertEqual([(r.ip, r.deviceId) for r in results], [('127.0.0.1', 0x2a)])
+
+    async def testNoAnswerWithinWindow(self):
+        await self.emulator.stop()
+        discovery = UdpDiscovery(port=self.emulator.port, window=0.05)
+        self.assertEqual(await asyncio.to_thread(discovery.discover, ['127.0.0.1']), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import threading
+import time
+import unittest
+from scheduler import Backoff, Scheduler
+
+class TestBackoff(unittest.TestCase):
+    def testGrowsExponentiallyUpToMaximum(self):
+        backoff = Backoff(initial=1, factor=2, maximum=5, jitter=0)
+        self.assertEqual([backoff.next() for _ in range(5)], [1, 2, 4, 5, 5])
+        backoff.reset()
+        self.assertEqual(backoff.next(), 1)
+
+    def testJitterOnlyShortensDelay(self):
+        backoff = Backoff(initial=1, factor=1, jitter=0.5)
+        for _ in range(100):
+            self.assertTrue(0.5 <= backoff.next() <= 1)
+
+class TestScheduler(unittest.TestCase):
+    def testRunDueRunsCallsInDeadlineOrder(self):
+        scheduler = Scheduler()
+        calls = []
+        scheduler.callLater(0.02, calls.append, "late")
+        scheduler.callLater(0, calls.append, "early")
+        scheduler.callLater(0, calls.append, "cancelled").cancel()
+        delay = scheduler.runDue()
+        self.assertEqual(calls, ["early"])
+        self.assertGreater(delay, 0)
+        time.sleep(delay)
+        self.assertIsNone(scheduler.runDue())
+        self.assertEqual(calls, ["early", "late"])
+
+    def testOwnThread(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        fired = threading.Event()
+        scheduler.callLater(0.05, fired.set)
+        self.assertTrue(fired.wait(1.0))
+        scheduler.stop()
+
+if __name__ == '__main__':
+    unittest.main()